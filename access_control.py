@@ -1,13 +1,14 @@
 # Copyright (C) @Wolfy004
 # Channel: https://t.me/Wolfy004
 
-import asyncio
 from functools import wraps
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
 from pyrogram.errors import UserNotParticipant, ChatAdminRequired, ChannelPrivate
 from database import db
 from logger import LOGGER
 from config import PyroConf
+from helpers.status import status_messages
+from client_pool import user_client_pool
 
 def admin_only(func):
     """Decorator to restrict command to admins only"""
@@ -100,16 +101,10 @@ def check_download_limit(func):
         # Show remaining downloads for free users with premium promotion
         user_type = db.get_user_type(user_id)
         if user_type == 'free' and message_text:
-            sent_msg = await message.reply(message_text)
-            
-            async def delete_after_delay():
-                try:
-                    await asyncio.sleep(10)
-                    await sent_msg.delete()
-                except Exception as e:
-                    LOGGER(__name__).debug(f"Could not delete message: {e}")
-            
-            asyncio.create_task(delete_after_delay())
+            try:
+                await status_messages.send_temporary(message, message_text, delete_after=10)
+            except Exception as e:
+                LOGGER(__name__).debug(f"Could not send remaining downloads message: {e}")
 
         return await func(client, message)
     return wrapper
@@ -142,24 +137,11 @@ async def check_user_session(user_id: int):
     return session is not None
 
 async def get_user_client(user_id: int):
-    """Get user's personal client if they have session"""
+    """Get user's personal client if they have session (pooled, release with release_user_client)"""
     session = db.get_user_session(user_id)
     if session:
-        from pyrogram import Client
-        from config import PyroConf
-
         try:
-            user_client = Client(
-                f"user_{user_id}",
-                api_id=PyroConf.API_ID,
-                api_hash=PyroConf.API_HASH,
-                session_string=session,
-                workers=8,
-                max_concurrent_transmissions=8,
-                in_memory=True  # Use in-memory sessions to avoid file leaks
-            )
-            await user_client.start()
-            return user_client
+            return await user_client_pool.acquire(user_id, session)
         except Exception as e:
             LOGGER(__name__).error(f"Failed to start user client for {user_id}: {e}")
             # Clear invalid session from database
@@ -167,6 +149,15 @@ async def get_user_client(user_id: int):
             return None
     return None
 
+async def release_user_client(user_client):
+    """Return a client from get_user_client to the pool"""
+    if user_client:
+        await user_client_pool.release(user_client)
+
+async def close_user_client(user_id: int):
+    """Disconnect the user's pooled client (e.g. after logout)"""
+    await user_client_pool.evict(user_id)
+
 def force_subscribe(func):
     """Decorator to enforce channel subscription before using bot features"""
     @wraps(func)
@@ -1,7 +1,6 @@
 # Copyright (C) @Wolfy004
 # Channel: https://t.me/Wolfy004
 
-import asyncio
 from pyrogram import Client, filters
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
 from access_control import admin_only, register_user
@@ -205,7 +204,6 @@ async def execute_broadcast(client: Client, admin_id: int, broadcast_message: st
         try:
             await client.send_message(user_id, broadcast_message)
             successful_sends += 1
-            await asyncio.sleep(0.1)  # Small delay to avoid rate limits
         except Exception as e:
             LOGGER(__name__).debug(f"Failed to send broadcast to {user_id}: {e}")
             continue
@@ -0,0 +1,225 @@
+# Copyright (C) @Wolfy004
+# Channel: https://t.me/Wolfy004
+
+import asyncio
+from time import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from pyrogram import Client
+
+from config import PyroConf
+from logger import LOGGER
+from peer_cache import PeerCachingClient
+from helpers.transfer import media_sessions
+
+# Seconds between refreshes of a pooled account's identity (premium flag, name)
+IDENTITY_REFRESH_INTERVAL = 3600
+
+
+def account_is_premium(client: Client) -> bool:
+    """Premium flag of the account behind a started client, from its cached identity"""
+    return bool(getattr(getattr(client, "me", None), "is_premium", False))
+
+
+@dataclass
+class PooledClient:
+    client: Client
+    session_string: str
+    refs: int = 0
+    last_used: float = field(default_factory=time)
+    last_checked: float = field(default_factory=time)
+
+
+class UserClientPool:
+    """
+    Keeps started per-user Pyrogram clients warm between downloads.
+
+    Clients are reference counted while in use, closed after idle_timeout
+    seconds without use, and the least recently used idle client is closed
+    when more than max_clients are connected. Clients idle for longer than
+    health_check_interval are pinged before being handed out again. The
+    account identity fetched on start (client.me) is refreshed by those pings
+    and hourly for busy clients, so callers never need get_me().
+    """
+
+    def __init__(self, max_clients: int = 50, idle_timeout: int = 600, health_check_interval: int = 120):
+        self.max_clients = max_clients
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+
+        self._clients: "OrderedDict[int, PooledClient]" = OrderedDict()
+        self._owners: Dict[int, int] = {}
+        # Clients dropped from the pool while still in use, stopped on their last release
+        self._retired: Dict[int, PooledClient] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._reaper: Optional[asyncio.Task] = None
+
+    def _lock_for(self, user_id: int) -> asyncio.Lock:
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        return lock
+
+    async def acquire(self, user_id: int, session_string: str) -> Client:
+        """Return a started client for the user, reusing a pooled one when possible"""
+        async with self._lock_for(user_id):
+            entry = self._clients.get(user_id)
+
+            if entry and entry.session_string != session_string:
+                # User logged in again, the old session is stale
+                await self._retire(user_id)
+                entry = None
+
+            if entry and not await self._is_healthy(entry):
+                LOGGER(__name__).info(f"Pooled client for user {user_id} failed health check, reconnecting")
+                await self._close(user_id)
+                entry = None
+
+            if entry and self._clients.get(user_id) is not entry:
+                # Closed while the health check ran (e.g. by close_all), start a new one
+                entry = None
+
+            if entry is None:
+                client = PeerCachingClient(
+                    f"user_{user_id}",
+                    api_id=PyroConf.API_ID,
+                    api_hash=PyroConf.API_HASH,
+                    session_string=session_string,
+                    workers=8,
+                    max_concurrent_transmissions=8,
+                    in_memory=True  # Use in-memory sessions to avoid file leaks
+                )
+                await client.start()
+                entry = PooledClient(client=client, session_string=session_string)
+                self._clients[user_id] = entry
+                self._owners[id(client)] = user_id
+                LOGGER(__name__).info(f"Started pooled client for user {user_id} ({len(self._clients)} connected)")
+
+            entry.refs += 1
+            entry.last_used = time()
+            self._clients.move_to_end(user_id)
+
+        await self._enforce_limit()
+        self._ensure_reaper()
+        return entry.client
+
+    async def release(self, client: Client):
+        """Give a client back to the pool after a download"""
+        retired = self._retired.get(id(client))
+        if retired and retired.client is client:
+            retired.refs = max(retired.refs - 1, 0)
+            if not retired.refs:
+                del self._retired[id(client)]
+                await self._stop(retired.client)
+            return
+
+        user_id = self._owners.get(id(client))
+        entry = self._clients.get(user_id) if user_id is not None else None
+        if not entry or entry.client is not client:
+            return
+        entry.refs = max(entry.refs - 1, 0)
+        entry.last_used = time()
+
+    async def evict(self, user_id: int):
+        """Take the user's client out of the pool (e.g. on logout); a busy one is stopped once released"""
+        async with self._lock_for(user_id):
+            await self._retire(user_id)
+
+    async def close_all(self):
+        if self._reaper and not self._reaper.done():
+            self._reaper.cancel()
+        for user_id in list(self._clients):
+            await self._close(user_id)
+        for retired in list(self._retired.values()):
+            await self._stop(retired.client)
+        self._retired.clear()
+
+    async def _is_healthy(self, entry: PooledClient) -> bool:
+        if not entry.client.is_connected:
+            return False
+        if time() - entry.last_checked < self.health_check_interval:
+            return True
+        try:
+            entry.client.me = await entry.client.get_me()
+            entry.last_checked = time()
+            return True
+        except Exception as e:
+            LOGGER(__name__).debug(f"Health check failed: {e}")
+            return False
+
+    async def _close(self, user_id: int):
+        entry = self._clients.pop(user_id, None)
+        if not entry:
+            return
+        self._owners.pop(id(entry.client), None)
+        await self._stop(entry.client)
+
+    async def _retire(self, user_id: int):
+        """Drop the user's client from the pool, stopping it now only if nobody is using it"""
+        entry = self._clients.get(user_id)
+        if entry and entry.refs > 0:
+            self._clients.pop(user_id)
+            self._owners.pop(id(entry.client), None)
+            self._retired[id(entry.client)] = entry
+            LOGGER(__name__).info(f"Client of user {user_id} is busy, stopping it after its last download")
+            return
+        await self._close(user_id)
+
+    async def _stop(self, client: Client):
+        try:
+            await media_sessions.close(client)
+            await client.stop()
+        except Exception as e:
+            LOGGER(__name__).debug(f"Error stopping client {client.name}: {e}")
+
+    async def _enforce_limit(self):
+        """Close least recently used idle clients beyond max_clients"""
+        while len(self._clients) > self.max_clients:
+            idle_user, entry = next(((uid, entry) for uid, entry in self._clients.items() if entry.refs == 0), (None, None))
+            if idle_user is None:
+                return  # every client is busy, allow a temporary overshoot
+            # Same locking as the reaper: the user may be acquiring this client right now
+            async with self._lock_for(idle_user):
+                if entry.refs == 0 and self._clients.get(idle_user) is entry:
+                    LOGGER(__name__).info(f"Client pool full, closing least recently used client of user {idle_user}")
+                    await self._close(idle_user)
+
+    def _ensure_reaper(self):
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_idle())
+
+    async def _reap_idle(self):
+        while self._clients:
+            await asyncio.sleep(60)
+            now = time()
+            for user_id, entry in list(self._clients.items()):
+                if entry.refs == 0 and now - entry.last_used > self.idle_timeout:
+                    async with self._lock_for(user_id):
+                        if entry.refs == 0 and self._clients.get(user_id) is entry:
+                            LOGGER(__name__).info(f"Closing idle client for user {user_id}")
+                            await self._close(user_id)
+                elif now - entry.last_checked > IDENTITY_REFRESH_INTERVAL:
+                    # Busy clients skip the health check, so their cached identity is refreshed here
+                    await self._refresh_identity(entry)
+
+    async def _refresh_identity(self, entry: PooledClient):
+        try:
+            entry.client.me = await entry.client.get_me()
+            entry.last_checked = time()
+        except Exception as e:
+            LOGGER(__name__).debug(f"Could not refresh account identity: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "connected": len(self._clients),
+            "busy": sum(1 for entry in self._clients.values() if entry.refs > 0),
+            "max_clients": self.max_clients,
+        }
+
+
+user_client_pool = UserClientPool(
+    max_clients=PyroConf.USER_CLIENT_POOL_SIZE,
+    idle_timeout=PyroConf.USER_CLIENT_IDLE_TIMEOUT
+)
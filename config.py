@@ -47,6 +47,106 @@ class PyroConf:
     AD_ID_9 = os.getenv("AD_ID_9", "")
     AD_ID_10 = os.getenv("AD_ID_10", "")
 
+    # Download queue backend: "local" (in-process) or "mongo" (shared by several bot instances)
+    QUEUE_BACKEND = os.getenv("QUEUE_BACKEND", "local").lower()
+    try:
+        QUEUE_LEASE_SECONDS = int(os.getenv("QUEUE_LEASE_SECONDS", "60"))
+    except ValueError:
+        QUEUE_LEASE_SECONDS = 60
+    INSTANCE_ID = os.getenv("INSTANCE_ID", "")
+
+    # Disk admission control for downloads/: byte budget (0 = unlimited) and the
+    # disk usage percentage new downloads may not push past
+    try:
+        DOWNLOAD_DISK_BUDGET = int(float(os.getenv("DOWNLOAD_DISK_BUDGET_GB", "0")) * 1024**3)
+    except ValueError:
+        DOWNLOAD_DISK_BUDGET = 0
+    try:
+        DISK_HIGH_WATER_PERCENT = float(os.getenv("DISK_HIGH_WATER_PERCENT", "90"))
+    except ValueError:
+        DISK_HIGH_WATER_PERCENT = 90.0
+
+    # Where job files are written; small jobs can go to a RAM disk (e.g. /dev/shm/bot) instead
+    STORAGE_ROOT = os.getenv("STORAGE_ROOT", "downloads")
+    STORAGE_TMPFS_DIR = os.getenv("STORAGE_TMPFS_DIR", "")
+    try:
+        STORAGE_TMPFS_MAX_SIZE = int(float(os.getenv("STORAGE_TMPFS_MAX_MB", "50")) * 1024**2)
+    except ValueError:
+        STORAGE_TMPFS_MAX_SIZE = 50 * 1024**2
+    # Seconds an unowned job folder is kept before the janitor deletes it
+    try:
+        STORAGE_WORKSPACE_GRACE = int(os.getenv("STORAGE_WORKSPACE_GRACE", "600"))
+    except ValueError:
+        STORAGE_WORKSPACE_GRACE = 600
+
+    # Warm per-user client pool: max connected clients and idle seconds before disconnect
+    try:
+        USER_CLIENT_POOL_SIZE = int(os.getenv("USER_CLIENT_POOL_SIZE", "50"))
+    except ValueError:
+        USER_CLIENT_POOL_SIZE = 50
+    try:
+        USER_CLIENT_IDLE_TIMEOUT = int(os.getenv("USER_CLIENT_IDLE_TIMEOUT", "600"))
+    except ValueError:
+        USER_CLIENT_IDLE_TIMEOUT = 600
+
+    # Stream photos/documents/audio from the source straight to the bot upload instead of
+    # downloading to disk first; the buffer holds this many 1 MiB chunks per transfer
+    STREAM_RELAY = os.getenv("STREAM_RELAY", "true").lower() == "true"
+    try:
+        RELAY_BUFFER_CHUNKS = max(int(os.getenv("RELAY_BUFFER_CHUNKS", "8")), 1)
+    except ValueError:
+        RELAY_BUFFER_CHUNKS = 8
+
+    # Parallel connections per large (20 MB+) download; 1 downloads over a single connection
+    try:
+        DOWNLOAD_CONNECTIONS = max(int(os.getenv("DOWNLOAD_CONNECTIONS", "4")), 1)
+    except ValueError:
+        DOWNLOAD_CONNECTIONS = 4
+
+    # Parallel connections per big (10 MB+) upload; 1 keeps the regular upload
+    try:
+        UPLOAD_CONNECTIONS = max(int(os.getenv("UPLOAD_CONNECTIONS", "4")), 1)
+    except ValueError:
+        UPLOAD_CONNECTIONS = 4
+
+    # Posts of a /bdl batch processed at the same time per user
+    try:
+        BATCH_CONCURRENCY = max(int(os.getenv("BATCH_CONCURRENCY", "3")), 1)
+    except ValueError:
+        BATCH_CONCURRENCY = 3
+
+    # Album items downloaded/uploaded at the same time per job
+    try:
+        ALBUM_CONCURRENCY = max(int(os.getenv("ALBUM_CONCURRENCY", "4")), 1)
+    except ValueError:
+        ALBUM_CONCURRENCY = 4
+
+    # ffmpeg/ffprobe processes running at once (0 = half the CPU cores)
+    try:
+        MEDIA_TOOL_CONCURRENCY = max(int(os.getenv("MEDIA_TOOL_CONCURRENCY", "0")), 0)
+    except ValueError:
+        MEDIA_TOOL_CONCURRENCY = 0
+
+    # Optional on-disk media cache keyed by file_unique_id (disabled when the dir is empty)
+    MEDIA_CACHE_DIR = os.getenv("MEDIA_CACHE_DIR", "")
+    try:
+        MEDIA_CACHE_SIZE = int(float(os.getenv("MEDIA_CACHE_SIZE_GB", "5")) * 1024**3)
+    except ValueError:
+        MEDIA_CACHE_SIZE = 5 * 1024**3
+
+    # Longest FloodWait (seconds) waited out before a call fails, and how many times a call is retried
+    try:
+        FLOOD_WAIT_MAX = int(os.getenv("FLOOD_WAIT_MAX", "300"))
+    except ValueError:
+        FLOOD_WAIT_MAX = 300
+    try:
+        FLOOD_WAIT_RETRIES = int(os.getenv("FLOOD_WAIT_RETRIES", "3"))
+    except ValueError:
+        FLOOD_WAIT_RETRIES = 3
+
+    # Token for the machine-readable /api/queue-metrics endpoint, which is off while unset
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
     BOT_START_TIME = time()
     
     @staticmethod
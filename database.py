@@ -4,8 +4,8 @@
 import os
 from datetime import datetime, timedelta
 from typing import Optional, List, Dict
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, OperationFailure
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import ConnectionFailure, OperationFailure, DuplicateKeyError
 from logger import LOGGER
 
 class DatabaseManager:
@@ -29,6 +29,9 @@ class DatabaseManager:
             self.broadcasts = self.db['broadcasts']
             self.ad_sessions = self.db['ad_sessions']
             self.ad_verifications = self.db['ad_verifications']
+            self.download_jobs = self.db['download_jobs']
+            self.media_index = self.db['media_index']
+            self.peer_cache = self.db['peer_cache']
             
             self.init_database()
             
@@ -49,6 +52,15 @@ class DatabaseManager:
             self.ad_sessions.create_index("created_at", expireAfterSeconds=300)
             self.ad_verifications.create_index("code", unique=True)
             self.ad_verifications.create_index("created_at", expireAfterSeconds=1800)
+            # One queued/active job per user across all bot instances
+            self.download_jobs.create_index("active_user", unique=True, sparse=True)
+            self.download_jobs.create_index([("status", 1), ("priority", 1), ("enqueued_at", 1)])
+            self.download_jobs.create_index("finished_at", expireAfterSeconds=86400)
+            # Bot-side file_id of media already delivered once, keyed by source file_unique_id
+            self.media_index.create_index("last_used", expireAfterSeconds=30 * 86400)
+            # Peers (id -> access_hash) resolved by each account, seeded into fresh clients
+            self.peer_cache.create_index([("account_id", 1), ("last_seen", -1)])
+            self.peer_cache.create_index("last_seen", expireAfterSeconds=30 * 86400)
             
             LOGGER(__name__).info("Database indexes created successfully")
         except Exception as e:
@@ -563,4 +575,241 @@ class DatabaseManager:
             LOGGER(__name__).error(f"Error deleting verification code {code}: {e}")
             return False
 
+    def enqueue_job(self, job: Dict) -> Optional[str]:
+        """Insert a queued download job. Returns None if the user already has one."""
+        try:
+            job_doc = dict(job)
+            job_doc.update({
+                "status": "queued",
+                "active_user": job["user_id"],
+                "attempts": 0,
+                "created_at": datetime.now()
+            })
+            result = self.download_jobs.insert_one(job_doc)
+            return str(result.inserted_id)
+        except DuplicateKeyError:
+            return None
+        except Exception as e:
+            LOGGER(__name__).error(f"Error enqueueing job for {job.get('user_id')}: {e}")
+            return None
+
+    def claim_job(self, owner: str, lease_seconds: int) -> Optional[Dict]:
+        """Atomically claim the highest priority queued job for this instance"""
+        try:
+            return self.download_jobs.find_one_and_update(
+                {"status": "queued"},
+                {"$set": {
+                    "status": "active",
+                    "lease_owner": owner,
+                    "lease_expires": datetime.now() + timedelta(seconds=lease_seconds),
+                    "claimed_at": datetime.now()
+                }},
+                sort=[("priority", 1), ("enqueued_at", 1)],
+                return_document=ReturnDocument.AFTER
+            )
+        except Exception as e:
+            LOGGER(__name__).error(f"Error claiming download job: {e}")
+            return None
+
+    def renew_job_lease(self, job_id, owner: str, lease_seconds: int) -> bool:
+        """Extend the lease on a job. False means this instance no longer owns it."""
+        try:
+            result = self.download_jobs.update_one(
+                {"_id": job_id, "status": "active", "lease_owner": owner},
+                {"$set": {"lease_expires": datetime.now() + timedelta(seconds=lease_seconds)}}
+            )
+            return result.matched_count > 0
+        except Exception as e:
+            LOGGER(__name__).error(f"Error renewing lease for job {job_id}: {e}")
+            # Keep working on transient errors; the lease will expire if we are really gone
+            return True
+
+    def requeue_expired_jobs(self, max_attempts: int = 3) -> int:
+        """Return jobs with expired leases to the queue (or fail them after max_attempts)"""
+        try:
+            now = datetime.now()
+            expired = {"status": "active", "lease_expires": {"$lt": now}}
+            failed = self.download_jobs.update_many(
+                {**expired, "attempts": {"$gte": max_attempts - 1}},
+                {"$set": {"status": "failed", "finished_at": now},
+                 "$unset": {"active_user": "", "lease_owner": "", "lease_expires": ""}}
+            )
+            requeued = self.download_jobs.update_many(
+                expired,
+                {"$set": {"status": "queued"},
+                 "$unset": {"lease_owner": "", "lease_expires": ""},
+                 "$inc": {"attempts": 1}}
+            )
+            if failed.modified_count:
+                LOGGER(__name__).warning(f"Failed {failed.modified_count} job(s) after {max_attempts} expired leases")
+            return requeued.modified_count
+        except Exception as e:
+            LOGGER(__name__).error(f"Error requeueing expired jobs: {e}")
+            return 0
+
+    def finish_job(self, job_id, status: str = "done", owner: Optional[str] = None) -> bool:
+        """Mark a job finished and release the user's queue slot (only if still held by owner)"""
+        try:
+            query = {"_id": job_id}
+            if owner:
+                query["lease_owner"] = owner
+            result = self.download_jobs.update_one(
+                query,
+                {"$set": {"status": status, "finished_at": datetime.now()},
+                 "$unset": {"active_user": "", "lease_owner": "", "lease_expires": ""}}
+            )
+            return result.modified_count > 0
+        except Exception as e:
+            LOGGER(__name__).error(f"Error finishing job {job_id}: {e}")
+            return False
+
+    def set_job_status_message(self, user_id: int, message_id: int) -> bool:
+        """Remember the queue status message so the claiming instance can edit it"""
+        try:
+            result = self.download_jobs.update_one(
+                {"active_user": user_id},
+                {"$set": {"status_message_id": message_id}}
+            )
+            return result.modified_count > 0
+        except Exception as e:
+            LOGGER(__name__).error(f"Error setting status message for job of {user_id}: {e}")
+            return False
+
+    def get_user_job(self, user_id: int) -> Optional[Dict]:
+        """Get the user's queued or active job"""
+        try:
+            return self.download_jobs.find_one({"active_user": user_id})
+        except Exception as e:
+            LOGGER(__name__).error(f"Error getting job for {user_id}: {e}")
+            return None
+
+    def cancel_user_job(self, user_id: int) -> Optional[Dict]:
+        """Cancel the user's queued or active job. Returns the job as it was before cancelling."""
+        try:
+            return self.download_jobs.find_one_and_update(
+                {"active_user": user_id},
+                {"$set": {"status": "cancelled", "finished_at": datetime.now()},
+                 "$unset": {"active_user": "", "lease_owner": "", "lease_expires": ""}}
+            )
+        except Exception as e:
+            LOGGER(__name__).error(f"Error cancelling job for {user_id}: {e}")
+            return None
+
+    def cancel_all_jobs(self) -> int:
+        """Cancel every queued and active job"""
+        try:
+            result = self.download_jobs.update_many(
+                {"status": {"$in": ["queued", "active"]}},
+                {"$set": {"status": "cancelled", "finished_at": datetime.now()},
+                 "$unset": {"active_user": "", "lease_owner": "", "lease_expires": ""}}
+            )
+            return result.modified_count
+        except Exception as e:
+            LOGGER(__name__).error(f"Error cancelling all jobs: {e}")
+            return 0
+
+    def get_job_position(self, job: Dict) -> int:
+        """1-based position of a queued job (priority first, then enqueue time)"""
+        try:
+            ahead = self.download_jobs.count_documents({
+                "status": "queued",
+                "$or": [
+                    {"priority": {"$lt": job["priority"]}},
+                    {"priority": job["priority"], "enqueued_at": {"$lt": job["enqueued_at"]}}
+                ]
+            })
+            return ahead + 1
+        except Exception as e:
+            LOGGER(__name__).error(f"Error getting job position: {e}")
+            return 0
+
+    def get_job_counts(self) -> Dict[str, int]:
+        """Count queued (by priority) and active jobs across all instances"""
+        try:
+            pipeline = [
+                {"$match": {"status": {"$in": ["queued", "active"]}}},
+                {"$group": {"_id": {"status": "$status", "priority": "$priority"}, "count": {"$sum": 1}}}
+            ]
+            counts = {"active": 0, "queued": 0, "queued_premium": 0}
+            for row in self.download_jobs.aggregate(pipeline):
+                status = row["_id"]["status"]
+                counts[status] += row["count"]
+                if status == "queued" and row["_id"]["priority"] == 1:
+                    counts["queued_premium"] += row["count"]
+            return counts
+        except Exception as e:
+            LOGGER(__name__).error(f"Error counting jobs: {e}")
+            return {"active": 0, "queued": 0, "queued_premium": 0}
+
+    def get_media_file(self, file_unique_id: str) -> Optional[Dict]:
+        """Look up the bot's file_id for source media delivered before"""
+        try:
+            return self.media_index.find_one_and_update(
+                {"_id": file_unique_id},
+                {"$set": {"last_used": datetime.now()}, "$inc": {"hits": 1}}
+            )
+        except Exception as e:
+            LOGGER(__name__).error(f"Error looking up media {file_unique_id}: {e}")
+            return None
+
+    def save_media_file(self, file_unique_id: str, file_id: str, media_type: str,
+                        chat_id=None, message_id: Optional[int] = None) -> bool:
+        """Remember the bot's file_id for source media after a successful upload"""
+        try:
+            self.media_index.update_one(
+                {"_id": file_unique_id},
+                {"$set": {
+                    "file_id": file_id,
+                    "media_type": media_type,
+                    "source_chat": str(chat_id) if chat_id is not None else None,
+                    "source_message": message_id,
+                    "last_used": datetime.now()
+                },
+                 "$setOnInsert": {"created_at": datetime.now(), "hits": 0}},
+                upsert=True
+            )
+            return True
+        except Exception as e:
+            LOGGER(__name__).error(f"Error saving media {file_unique_id}: {e}")
+            return False
+
+    def delete_media_file(self, file_unique_id: str) -> bool:
+        """Drop a cached file_id that Telegram no longer accepts"""
+        try:
+            result = self.media_index.delete_one({"_id": file_unique_id})
+            return result.deleted_count > 0
+        except Exception as e:
+            LOGGER(__name__).error(f"Error deleting media {file_unique_id}: {e}")
+            return False
+
+    def get_peers(self, account_id: int, limit: int = 5000) -> List[Dict]:
+        """Most recently seen peers of an account"""
+        try:
+            return list(
+                self.peer_cache.find({"account_id": account_id})
+                .sort("last_seen", -1)
+                .limit(limit)
+            )
+        except Exception as e:
+            LOGGER(__name__).error(f"Error loading peers of account {account_id}: {e}")
+            return []
+
+    def save_peers(self, account_id: int, peers: List[Dict]) -> bool:
+        """Upsert peers an account resolved (peer_id, access_hash, type, username, last_seen)"""
+        if not peers:
+            return True
+        try:
+            self.peer_cache.bulk_write([
+                UpdateOne(
+                    {"_id": f"{account_id}:{peer['peer_id']}"},
+                    {"$set": dict(peer, account_id=account_id)},
+                    upsert=True
+                )
+                for peer in peers
+            ], ordered=False)
+            return True
+        except Exception as e:
+            LOGGER(__name__).error(f"Error saving peers of account {account_id}: {e}")
+            return False
+
 db = DatabaseManager()
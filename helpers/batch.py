@@ -0,0 +1,46 @@
+# Copyright (C) @Wolfy004
+# Channel: https://t.me/Wolfy004
+
+import asyncio
+from contextlib import asynccontextmanager
+
+from helpers.files import DiskBudget, disk_budget
+
+
+class DeliveryOrder:
+    """
+    Lets batch posts download concurrently while delivering them in post order.
+
+    A post keeps its disk reservation until it has sent, and it can only send
+    after every earlier post. Reservations are therefore taken in post order
+    too: if a later post could reserve first, an earlier one might wait for
+    space that is only freed once the earlier post itself has been delivered.
+    """
+
+    def __init__(self, count: int, budget: DiskBudget = disk_budget):
+        self.budget = budget
+        self._reserved = [asyncio.Event() for _ in range(count)]
+        self._delivered = [asyncio.Event() for _ in range(count)]
+
+    async def wait(self, index: int):
+        if index > 0:
+            await self._delivered[index - 1].wait()
+
+    @asynccontextmanager
+    async def reservation(self, index: int, key: str, size: int):
+        """Disk reservation for a post, granted after every earlier post got or skipped its own"""
+        if index > 0:
+            await self._reserved[index - 1].wait()
+        try:
+            await self.budget.reserve(key, size)
+        finally:
+            self._reserved[index].set()
+        try:
+            yield
+        finally:
+            await self.budget.release(key)
+
+    def done(self, index: int):
+        # Posts that never reserved (copied, relayed, failed) must not hold later ones back
+        self._reserved[index].set()
+        self._delivered[index].set()
@@ -1,17 +1,223 @@
 # Copyright (C) @TheSmartBisnu
 
 import os
-from typing import Optional
+import shutil
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
 
 from logger import LOGGER
+from metrics import metrics
+from config import PyroConf
+from helpers.storage import storage
 
 SIZE_UNITS = ["B", "KB", "MB", "GB", "TB", "PB"]
 
-def get_download_path(folder_id: int, filename: str, root_dir: str = "downloads") -> str:
-    folder = os.path.join(root_dir, str(folder_id))
-    os.makedirs(folder, exist_ok=True)
-    return os.path.join(folder, filename)
 
+class DiskSpaceError(Exception):
+    """Raised when a download can never fit in the configured disk budget"""
+
+
+class DiskBudget:
+    """
+    Admission control for files written under the downloads root.
+
+    Each job reserves its expected size before it starts writing. A reservation
+    is granted only if it stays within the byte budget (0 = no budget) and keeps
+    disk usage under the high-water mark; otherwise the job waits until other
+    jobs release their reservations.
+    """
+
+    def __init__(self, root_dir: str = "downloads", budget_bytes: int = 0, high_water_percent: float = 90):
+        self.root_dir = root_dir
+        self.budget_bytes = budget_bytes
+        self.high_water_percent = high_water_percent
+        self._reservations: Dict[str, int] = {}
+        self._waiting = 0
+        self._changed = asyncio.Condition()
+
+    @property
+    def reserved(self) -> int:
+        return sum(self._reservations.values())
+
+    def _disk_usage(self):
+        os.makedirs(self.root_dir, exist_ok=True)
+        return shutil.disk_usage(self.root_dir)
+
+    def _fits(self, size: int, reserved: int) -> bool:
+        if self.budget_bytes and reserved + size > self.budget_bytes:
+            return False
+        total, used, _ = self._disk_usage()
+        # Reserved bytes may already be partly on disk, so this errs on the safe side
+        return (used + reserved + size) <= total * self.high_water_percent / 100
+
+    def can_ever_fit(self, size: int) -> bool:
+        if self.budget_bytes and size > self.budget_bytes:
+            return False
+        total, used, _ = self._disk_usage()
+        return size <= total * self.high_water_percent / 100
+
+    def fits(self, size: int) -> bool:
+        return self._fits(size, self.reserved)
+
+    async def reserve(self, key: str, size: int):
+        """Wait until size bytes can be reserved under key"""
+        size = max(int(size or 0), 0)
+        if not self.can_ever_fit(size):
+            raise DiskSpaceError(
+                f"Not enough disk space for this file ({get_readable_file_size(size)}). Please try again later."
+            )
+        async with self._changed:
+            self._waiting += 1
+            try:
+                # A lone job is always admitted so an oversized reservation can't stall forever
+                while self._reservations and not self._fits(size, self.reserved):
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), timeout=30)
+                    except asyncio.TimeoutError:
+                        pass  # re-check: files outside our control may have been removed
+            finally:
+                self._waiting -= 1
+            self._reservations[key] = self._reservations.get(key, 0) + size
+
+    async def release(self, key: str):
+        async with self._changed:
+            if self._reservations.pop(key, None) is not None:
+                self._changed.notify_all()
+
+    @asynccontextmanager
+    async def reservation(self, key: str, size: int):
+        await self.reserve(key, size)
+        try:
+            yield
+        finally:
+            await self.release(key)
+
+    def status(self) -> Dict[str, int]:
+        total, used, free = self._disk_usage()
+        return {
+            "reserved": self.reserved,
+            "reservations": len(self._reservations),
+            "waiting": self._waiting,
+            "budget": self.budget_bytes,
+            "free": free,
+            "free_after_reservations": max(free - self.reserved, 0),
+            "high_water_percent": self.high_water_percent,
+        }
+
+class MediaCache:
+    """
+    Optional on-disk cache of downloaded media, keyed by source file_unique_id.
+
+    Files enter the cache via a temporary name and os.replace, so a crash never
+    leaves a partial entry behind. Readers get their own hard link (or copy) of
+    the cached file in their job folder, which keeps the bytes alive even if the
+    entry is evicted while they upload. Least recently used entries are evicted
+    once the cache grows past max_bytes.
+    """
+
+    TMP_SUFFIX = ".tmp"
+
+    def __init__(self, root_dir: str = "", max_bytes: int = 0):
+        self.root_dir = root_dir
+        self.max_bytes = max_bytes
+        self.enabled = bool(root_dir) and max_bytes > 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        if self.enabled:
+            self._load()
+
+    def _load(self):
+        os.makedirs(self.root_dir, exist_ok=True)
+        found = []
+        for name in os.listdir(self.root_dir):
+            path = os.path.join(self.root_dir, name)
+            if name.endswith(self.TMP_SUFFIX):
+                # Left over from a write interrupted by a crash
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            found.append((stat.st_atime, name, stat.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+        self._evict()
+        LOGGER(__name__).info(
+            f"Media cache at {self.root_dir}: {len(self._entries)} files, "
+            f"{get_readable_file_size(self.size)} of {get_readable_file_size(self.max_bytes)}"
+        )
+
+    @property
+    def size(self) -> int:
+        return sum(self._entries.values())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root_dir, "".join(c for c in key if c.isalnum() or c in "-_"))
+
+    @staticmethod
+    def _link_or_copy(src: str, dest: str):
+        try:
+            os.link(src, dest)
+        except OSError:
+            # Different filesystem or no hard link support
+            shutil.copyfile(src, dest)
+
+    async def fetch(self, key: Optional[str], dest_path: str) -> Optional[str]:
+        """Place a cached copy of key at dest_path, returns dest_path on a hit"""
+        if not self.enabled or not key:
+            return None
+        path = self._path(key)
+        if key not in self._entries or not os.path.exists(path):
+            self._entries.pop(key, None)
+            metrics.incr("media_cache", result="miss")
+            return None
+        try:
+            if os.path.exists(dest_path):
+                os.remove(dest_path)
+            await asyncio.to_thread(self._link_or_copy, path, dest_path)
+        except Exception as e:
+            LOGGER(__name__).warning(f"Could not read {key} from media cache: {e}")
+            metrics.incr("media_cache", result="miss")
+            return None
+        self._entries.move_to_end(key)
+        metrics.incr("media_cache", result="hit")
+        LOGGER(__name__).info(f"Media cache hit for {key}")
+        return dest_path
+
+    async def store(self, key: Optional[str], src_path: str):
+        """Add a downloaded file to the cache (the source file is left in place)"""
+        if not self.enabled or not key or key in self._entries:
+            return
+        try:
+            size = os.path.getsize(src_path)
+            if size > self.max_bytes:
+                return
+            path = self._path(key)
+            tmp_path = f"{path}.{os.getpid()}{self.TMP_SUFFIX}"
+            await asyncio.to_thread(self._link_or_copy, src_path, tmp_path)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            LOGGER(__name__).warning(f"Could not add {key} to media cache: {e}")
+            return
+        self._entries[key] = size
+        self._evict()
+
+    def _evict(self):
+        while self._entries and self.size > self.max_bytes:
+            key, _ = self._entries.popitem(last=False)
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                LOGGER(__name__).warning(f"Could not evict {key} from media cache: {e}")
+
+    def status(self) -> Dict[str, int]:
+        return {
+            "enabled": self.enabled,
+            "files": len(self._entries),
+            "size": self.size,
+            "max_bytes": self.max_bytes,
+        }
 
 def cleanup_download(path: str) -> None:
     try:
@@ -21,10 +227,7 @@ def cleanup_download(path: str) -> None:
             os.remove(path)
         if os.path.exists(path + ".temp"):
             os.remove(path + ".temp")
-
-        folder = os.path.dirname(path)
-        if os.path.isdir(folder) and not os.listdir(folder):
-            os.rmdir(folder)
+        # The folder is a job workspace, storage removes it when the job ends
 
     except Exception as e:
         LOGGER(__name__).error(f"Cleanup failed for {path}: {e}")
@@ -69,3 +272,15 @@ async def fileSizeLimit(file_size, message, action_type="download", is_premium=F
         )
         return False
     return True
+
+
+media_cache = MediaCache(
+    root_dir=PyroConf.MEDIA_CACHE_DIR,
+    max_bytes=PyroConf.MEDIA_CACHE_SIZE
+)
+
+disk_budget = DiskBudget(
+    root_dir=storage.root,
+    budget_bytes=PyroConf.DOWNLOAD_DISK_BUDGET,
+    high_water_percent=PyroConf.DISK_HIGH_WATER_PERCENT
+)
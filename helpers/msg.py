@@ -63,3 +63,15 @@ def get_file_name(message_id: int, chat_message) -> str:
         return f"{message_id}.jpg"
     else:
         return f"{message_id}"
+
+
+def get_media_object(chat_message):
+    """The Photo/Video/Document/... object of a media message, None otherwise"""
+    if not chat_message or not chat_message.media:
+        return None
+    return getattr(chat_message, chat_message.media.value, None)
+
+
+def get_media_size(chat_message) -> int:
+    """Size in bytes of the message's media, 0 when unknown"""
+    return getattr(get_media_object(chat_message), "file_size", 0) or 0
@@ -0,0 +1,165 @@
+# Copyright (C) @Wolfy004
+# Channel: https://t.me/Wolfy004
+
+import asyncio
+from time import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from logger import LOGGER
+from helpers.files import get_readable_file_size, get_readable_time
+
+BAR_LENGTH = 20
+
+
+@dataclass
+class Phase:
+    current: int = 0
+    total: int = 0
+    started: float = field(default_factory=time)
+
+
+@dataclass
+class ProgressEntry:
+    message: Any
+    phases: Dict[str, Phase] = field(default_factory=dict)
+    active: str = ""
+    updated: float = field(default_factory=time)
+    dirty: bool = False
+    text: str = ""
+
+
+class ProgressHub:
+    """
+    Collects byte counters from every transfer and renders them centrally.
+
+    Progress callbacks only record numbers in memory. One renderer task edits
+    the progress messages, at most once per min_interval per chat and slower
+    when many chats are active so the whole bot stays within edit_budget
+    edits per second. Download and upload phases of a job share one message,
+    and a message is only edited when its text actually changed.
+    """
+
+    def __init__(self, min_interval: float = 3.0, edit_budget: float = 8.0, stale_after: float = 120):
+        self.min_interval = min_interval
+        self.edit_budget = edit_budget
+        self.stale_after = stale_after
+
+        self._entries: Dict[Tuple[int, int], ProgressEntry] = {}
+        self._last_edit: Dict[int, float] = {}
+        self._editing: Dict[int, asyncio.Task] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._renderer: Optional[asyncio.Task] = None
+
+    async def update(self, current: int, total: int, action: str, progress_message, start_time=None):
+        """Progress callback for downloads and uploads (see progressArgs)"""
+        if progress_message is None:
+            return
+        key = (progress_message.chat.id, progress_message.id)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = ProgressEntry(progress_message)
+            self._ensure_renderer()
+        phase = entry.phases.get(action)
+        if phase is None:
+            phase = entry.phases[action] = Phase()
+        phase.current, phase.total = current, total
+        entry.active = action
+        entry.updated = time()
+        entry.dirty = True
+
+    def finish(self, progress_message):
+        """Stop rendering a progress message, e.g. before it is deleted"""
+        if progress_message is not None:
+            self._entries.pop((progress_message.chat.id, progress_message.id), None)
+
+    async def close(self, progress_message):
+        """Stop rendering and delete the progress message"""
+        self.finish(progress_message)
+        await progress_message.delete()
+
+    def summary(self, chat_id: int) -> List[str]:
+        """One line per running transfer in the chat, straight from memory"""
+        lines = []
+        for (entry_chat, _), entry in list(self._entries.items()):
+            phase = entry.phases.get(entry.active)
+            if entry_chat != chat_id or not phase:
+                continue
+            percentage = phase.current * 100 / phase.total if phase.total else 0
+            speed = phase.current / max(time() - phase.started, 1e-3)
+            lines.append(f"{entry.active}: {percentage:.1f}% at {get_readable_file_size(speed)}/s")
+        return lines
+
+    def render(self, entry: ProgressEntry) -> str:
+        lines = []
+        for action, phase in entry.phases.items():
+            if action != entry.active:
+                lines.append(f"{action} ✅ {get_readable_file_size(phase.total)}")
+                continue
+
+            percentage = phase.current * 100 / phase.total if phase.total else 0
+            elapsed = max(time() - phase.started, 1e-3)
+            speed = phase.current / elapsed
+            eta = (phase.total - phase.current) / speed if speed else 0
+            filled = min(int(percentage / 100 * BAR_LENGTH), BAR_LENGTH)
+            lines.append(
+                f"{action}\n\n"
+                f"{'▓' * filled}{'░' * (BAR_LENGTH - filled)}\n"
+                f"Percentage: {percentage:.2f}% | {get_readable_file_size(phase.current)}/{get_readable_file_size(phase.total)}\n"
+                f"Speed: {get_readable_file_size(speed)}/s\n"
+                f"Estimated Time Left: {get_readable_time(eta)}"
+            )
+        return "\n".join(lines)
+
+    def interval(self) -> float:
+        chats = len({chat_id for chat_id, _ in self._entries})
+        return max(self.min_interval, chats / self.edit_budget)
+
+    def _ensure_renderer(self):
+        if self._renderer is None or self._renderer.done():
+            self._wakeup = asyncio.Event()
+            self._renderer = asyncio.create_task(self._run())
+        else:
+            self._wakeup.set()
+
+    async def _edit(self, key: Tuple[int, int], entry: ProgressEntry, text: str):
+        try:
+            await entry.message._client.edit_message_text(key[0], key[1], text)
+            entry.text = text
+        except Exception as e:
+            LOGGER(__name__).debug(f"Could not edit progress message {key[1]}: {e}")
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if not self._entries:
+                await self._wakeup.wait()
+                continue
+
+            now = time()
+            interval = self.interval()
+            for key, entry in list(self._entries.items()):
+                chat_id = key[0]
+                if now - entry.updated > self.stale_after:
+                    # The job ended without finish(), stop tracking it
+                    self._entries.pop(key, None)
+                    continue
+                if not entry.dirty or now - self._last_edit.get(chat_id, 0) < interval:
+                    continue
+                editing = self._editing.get(chat_id)
+                if editing and not editing.done():
+                    continue
+
+                entry.dirty = False
+                text = self.render(entry)
+                if text == entry.text:
+                    continue
+                self._last_edit[chat_id] = now
+                self._editing[chat_id] = asyncio.create_task(self._edit(key, entry, text))
+
+            for chat_id in [chat_id for chat_id, task in self._editing.items() if task.done()]:
+                del self._editing[chat_id]
+            await asyncio.sleep(1)
+
+
+progress_hub = ProgressHub()
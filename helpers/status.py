@@ -0,0 +1,166 @@
+# Copyright (C) @Wolfy004
+# Channel: https://t.me/Wolfy004
+
+import asyncio
+import heapq
+from time import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from logger import LOGGER
+
+
+@dataclass
+class StatusEntry:
+    client: Any
+    chat_id: int
+    message_id: int
+    text: str = ""
+    message: Any = None
+
+
+class StatusMessages:
+    """
+    One status message per job, edited in place as the job changes state.
+
+    Updates for a key are serialized so they land in the order they were issued.
+    Edits are rate limited per chat; if several updates arrive within the interval
+    only the newest text is sent. Deletions go through a single scheduler task
+    that batches them per chat instead of one sleeping task per message.
+    """
+
+    def __init__(self, min_interval: float = 1.5):
+        self.min_interval = min_interval
+        self._entries: Dict[Any, StatusEntry] = {}
+        self._pending: Dict[Any, str] = {}
+        self._locks: Dict[Any, asyncio.Lock] = {}
+        self._last_edit: Dict[int, float] = {}
+
+        self._deletions: List[Tuple[float, int, Any, int, int]] = []
+        self._seq = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._scheduler: Optional[asyncio.Task] = None
+
+    def _lock_for(self, key) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        return lock
+
+    async def _edit(self, entry: StatusEntry, text: str):
+        try:
+            edited = await entry.client.edit_message_text(entry.chat_id, entry.message_id, text)
+            if edited:
+                entry.message = edited
+        except Exception as e:
+            LOGGER(__name__).debug(f"Could not edit status message {entry.message_id}: {e}")
+        entry.text = text
+        self._last_edit[entry.chat_id] = time()
+
+    async def update(self, key, message, text: str):
+        """Create the job's status message, or edit it if it already exists"""
+        self._pending[key] = text
+        async with self._lock_for(key):
+            text = self._pending.pop(key, None)
+            entry = self._entries.get(key)
+            if text is None:
+                # A newer update for this key was already sent while we waited
+                return entry.message if entry else None
+
+            if entry is None:
+                try:
+                    sent = await message.reply(text)
+                except Exception as e:
+                    LOGGER(__name__).debug(f"Could not send status message: {e}")
+                    return None
+                self._entries[key] = StatusEntry(sent._client, sent.chat.id, sent.id, text, sent)
+                self._last_edit[sent.chat.id] = time()
+                return sent
+
+            if text == entry.text:
+                return entry.message
+
+            delay = self._last_edit.get(entry.chat_id, 0) + self.min_interval - time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                text = self._pending.pop(key, text)
+            await self._edit(entry, text)
+            return entry.message
+
+    def adopt(self, key, client, chat_id: int, message_id: int):
+        """Track a status message sent elsewhere (e.g. by another bot instance)"""
+        if key not in self._entries:
+            self._entries[key] = StatusEntry(client, chat_id, message_id)
+
+    async def claim(self, key, message, text: str):
+        """Hand the job's status message over (e.g. as a progress message), replying if there is none"""
+        async with self._lock_for(key):
+            self._pending.pop(key, None)
+            entry = self._entries.pop(key, None)
+            if entry:
+                try:
+                    edited = await entry.client.edit_message_text(entry.chat_id, entry.message_id, text)
+                    self._last_edit[entry.chat_id] = time()
+                    if edited:
+                        return edited
+                except Exception as e:
+                    LOGGER(__name__).debug(f"Could not reuse status message {entry.message_id}: {e}")
+            return await message.reply(text)
+
+    def forget(self, key) -> Optional[StatusEntry]:
+        """Stop tracking the job's status message, leaving it in the chat"""
+        self._pending.pop(key, None)
+        self._locks.pop(key, None)
+        return self._entries.pop(key, None)
+
+    def finish(self, key, delete_after: float = 10):
+        """Forget the job and delete its status message after a delay"""
+        entry = self.forget(key)
+        if entry:
+            self.schedule_delete(entry.client, entry.chat_id, entry.message_id, delete_after)
+
+    async def send_temporary(self, message, text: str, delete_after: float = 10):
+        """Reply with a message that is deleted after delete_after seconds"""
+        sent = await message.reply(text)
+        self.schedule_delete(sent._client, sent.chat.id, sent.id, delete_after)
+        return sent
+
+    def schedule_delete(self, client, chat_id: int, message_id: int, delay: float):
+        self._seq += 1
+        heapq.heappush(self._deletions, (time() + delay, self._seq, client, chat_id, message_id))
+        if self._scheduler is None or self._scheduler.done():
+            self._wakeup = asyncio.Event()
+            self._scheduler = asyncio.create_task(self._run_deletions())
+        else:
+            self._wakeup.set()
+
+    async def _run_deletions(self):
+        while True:
+            self._wakeup.clear()
+            if not self._deletions:
+                await self._wakeup.wait()
+                continue
+
+            delay = self._deletions[0][0] - time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # Batch everything that is due into one delete call per chat
+            batches: Dict[Tuple[int, int], Tuple[Any, List[int]]] = {}
+            now = time()
+            while self._deletions and self._deletions[0][0] <= now:
+                _, _, client, chat_id, message_id = heapq.heappop(self._deletions)
+                batches.setdefault((id(client), chat_id), (client, []))[1].append(message_id)
+
+            for (_, chat_id), (client, message_ids) in batches.items():
+                try:
+                    await client.delete_messages(chat_id, message_ids)
+                except Exception as e:
+                    LOGGER(__name__).debug(f"Failed to delete status messages {message_ids}: {e}")
+
+
+status_messages = StatusMessages()
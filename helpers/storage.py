@@ -0,0 +1,237 @@
+# Copyright (C) @Wolfy004
+# Channel: https://t.me/Wolfy004
+
+import os
+import fcntl
+import shutil
+import asyncio
+from time import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from logger import LOGGER
+from metrics import metrics
+from config import PyroConf
+
+PARTIAL_DIRNAME = ".partial"
+THUMBS_DIRNAME = ".thumbs"
+# Locked by the process using a workspace, in any instance sharing the root
+OWNER_FILENAME = ".owner"
+
+
+class StorageManager:
+    """
+    Owns the files the bot writes while handling jobs.
+
+    Downloads go to a per-job workspace under root, or under tmpfs_dir (e.g. a
+    RAM disk) for jobs smaller than tmpfs_max_size. A workspace is removed as a
+    whole when its job ends, whatever the job left behind. Partial downloads and
+    temporary thumbnails live in their own folders. A janitor runs at start and
+    every interval seconds and deletes workspaces no job owns, stale partial
+    downloads and old thumbnails, so crashes and restarts can't fill the disk.
+    A workspace is owned while its process holds the lock on its owner file,
+    so instances sharing the root never delete each other's workspaces.
+    """
+
+    def __init__(
+        self,
+        root: str = "downloads",
+        tmpfs_dir: str = "",
+        tmpfs_max_size: int = 0,
+        workspace_grace: int = 600,
+        partial_max_age: int = 86400,
+        thumb_max_age: int = 3600,
+        interval: int = 1800,
+    ):
+        self.root = root
+        self.tmpfs_dir = tmpfs_dir
+        self.tmpfs_max_size = tmpfs_max_size
+        self.workspace_grace = workspace_grace
+        self.partial_max_age = partial_max_age
+        self.thumb_max_age = thumb_max_age
+        self.interval = interval
+
+        self._active: Dict[str, int] = {}
+        self._owner_fds: Dict[str, int] = {}
+        self._janitor: Optional[asyncio.Task] = None
+        self.last_usage: Dict[str, int] = {}
+
+    @property
+    def partial_dir(self) -> str:
+        return os.path.join(self.root, PARTIAL_DIRNAME)
+
+    @property
+    def thumbs_dir(self) -> str:
+        path = os.path.join(self.tmpfs_dir or self.root, THUMBS_DIRNAME)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _roots(self):
+        return [self.root] + ([self.tmpfs_dir] if self.tmpfs_dir else [])
+
+    def _base_for(self, size: int) -> str:
+        """tmpfs for small jobs while it has room for them twice over, disk otherwise"""
+        if self.tmpfs_dir and 0 < size <= self.tmpfs_max_size:
+            try:
+                os.makedirs(self.tmpfs_dir, exist_ok=True)
+                if shutil.disk_usage(self.tmpfs_dir).free > size * 2:
+                    return self.tmpfs_dir
+            except OSError as e:
+                LOGGER(__name__).warning(f"tmpfs dir {self.tmpfs_dir} unusable, using {self.root}: {e}")
+        return self.root
+
+    @contextmanager
+    def workspace(self, job_id: str, size: int = 0):
+        """Directory for one job's files, deleted with its contents when the last user leaves"""
+        path = os.path.join(self._base_for(size), "".join(c for c in str(job_id) if c.isalnum() or c in "-_"))
+        os.makedirs(path, exist_ok=True)
+        if path not in self._active:
+            self._owner_fds[path] = _lock_owner(path)
+        self._active[path] = self._active.get(path, 0) + 1
+        try:
+            yield path
+        finally:
+            self._active[path] -= 1
+            if not self._active[path]:
+                del self._active[path]
+                shutil.rmtree(path, ignore_errors=True)
+                owner_fd = self._owner_fds.pop(path)
+                if owner_fd is not None:
+                    os.close(owner_fd)
+
+    def collect(self) -> Dict[str, int]:
+        """One janitor pass; returns the bytes reclaimed per area and refreshes last_usage"""
+        now = time()
+        reclaimed = {"workspaces": 0, "partial": 0, "thumbs": 0}
+        usage = {"files": 0, "bytes": 0}
+
+        for base in self._roots():
+            if not os.path.isdir(base):
+                continue
+            for name in os.listdir(base):
+                path = os.path.join(base, name)
+                if name == PARTIAL_DIRNAME:
+                    reclaimed["partial"] += self._expire_files(path, now - self.partial_max_age, usage)
+                elif name == THUMBS_DIRNAME:
+                    reclaimed["thumbs"] += self._expire_files(path, now - self.thumb_max_age, usage)
+                elif path in self._active or now - _mtime(path) < self.workspace_grace:
+                    files, size = _tree_size(path)
+                    usage["files"] += files
+                    usage["bytes"] += size
+                elif not os.path.isdir(path):
+                    reclaimed["workspaces"] += _tree_size(path)[1]
+                    _remove(path)
+                else:
+                    owner_fd = _lock_owner(path)
+                    if owner_fd is None:
+                        continue  # in use by another process sharing this root
+                    try:
+                        # Left behind by a crashed or killed job
+                        reclaimed["workspaces"] += _tree_size(path)[1]
+                        shutil.rmtree(path, ignore_errors=True)
+                    finally:
+                        os.close(owner_fd)
+
+        for area, size in reclaimed.items():
+            if size:
+                metrics.incr("storage_reclaimed_bytes", size, area=area)
+        usage["active_workspaces"] = len(self._active)
+        try:
+            total, used, free = shutil.disk_usage(self.root)
+            usage.update(disk_total=total, disk_used=used, disk_free=free)
+        except OSError:
+            pass
+        self.last_usage = usage
+        return reclaimed
+
+    def _expire_files(self, folder: str, cutoff: float, usage: Dict[str, int]) -> int:
+        """Delete top-level files older than cutoff, count the rest into usage"""
+        reclaimed = 0
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            if os.path.isdir(path):
+                # Sub-caches (e.g. processed thumbnails) manage their own size
+                files, size = _tree_size(path)
+            elif _mtime(path) < cutoff:
+                size = _tree_size(path)[1]
+                if _remove(path):
+                    reclaimed += size
+                continue
+            else:
+                files, size = 1, _tree_size(path)[1]
+            usage["files"] += files
+            usage["bytes"] += size
+        return reclaimed
+
+    async def sweep(self):
+        reclaimed = await asyncio.get_running_loop().run_in_executor(None, self.collect)
+        total = sum(reclaimed.values())
+        if total:
+            LOGGER(__name__).info(f"Storage janitor reclaimed {total} bytes {reclaimed}")
+
+    def start_janitor(self):
+        """Sweep now and then every interval seconds on the running loop"""
+        if self._janitor is None or self._janitor.done():
+            self._janitor = asyncio.create_task(self._run_janitor())
+
+    async def _run_janitor(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                LOGGER(__name__).error(f"Storage janitor failed: {e}")
+            await asyncio.sleep(self.interval)
+
+
+def _lock_owner(workspace: str) -> Optional[int]:
+    """Open and lock the workspace's owner file; None if another process holds it"""
+    try:
+        fd = os.open(os.path.join(workspace, OWNER_FILENAME), os.O_RDWR | os.O_CREAT, 0o644)
+    except OSError:
+        return None
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _mtime(path: str) -> float:
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0
+
+
+def _remove(path: str) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
+
+
+def _tree_size(path: str):
+    if not os.path.isdir(path):
+        try:
+            return 1, os.path.getsize(path)
+        except OSError:
+            return 0, 0
+    files = size = 0
+    for folder, _, names in os.walk(path):
+        for name in names:
+            try:
+                size += os.path.getsize(os.path.join(folder, name))
+                files += 1
+            except OSError:
+                pass
+    return files, size
+
+
+storage = StorageManager(
+    root=PyroConf.STORAGE_ROOT,
+    tmpfs_dir=PyroConf.STORAGE_TMPFS_DIR,
+    tmpfs_max_size=PyroConf.STORAGE_TMPFS_MAX_SIZE,
+    workspace_grace=PyroConf.STORAGE_WORKSPACE_GRACE,
+)
@@ -0,0 +1,709 @@
+# Copyright (C) @Wolfy004
+# Channel: https://t.me/Wolfy004
+
+import os
+import json
+import math
+import shutil
+import asyncio
+import inspect
+from time import time
+from hashlib import md5
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from pyrogram import raw, types, utils
+from pyrogram.errors import (
+    FloodWait,
+    RPCError,
+    InternalServerError,
+    ServiceUnavailable,
+    MediaEmpty,
+    FileIdInvalid,
+    FileReferenceExpired,
+    FileReferenceInvalid,
+    MessageIdInvalid,
+    ChannelPrivate
+)
+from pyrogram.file_id import FileId
+from pyrogram.session import Auth, Session
+
+from logger import LOGGER
+from metrics import metrics
+from config import PyroConf
+from database import db
+from helpers.msg import get_file_name, get_media_size, get_media_object
+from helpers.storage import storage
+
+# Telegram upload part size and the size above which SaveBigFilePart is required
+UPLOAD_PART_SIZE = 512 * 1024
+BIG_FILE_THRESHOLD = 10 * 1024 * 1024
+# Largest file a bot may upload
+MAX_UPLOAD_SIZE = 2097152000
+# GetFile chunk size (the maximum Telegram serves per request)
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Files below this size are not worth opening extra connections for
+PARALLEL_MIN_SIZE = 20 * 1024 * 1024
+# Seconds a chat the bot could not copy from is skipped before trying again
+COPY_DENIED_TTL = 1800
+# Attempts to resend an indexed file_id through transient errors
+INDEX_SEND_ATTEMPTS = 3
+
+# Errors meaning an indexed file_id is gone for good; anything else keeps the entry
+STALE_FILE_ERRORS = (
+    MediaEmpty,
+    FileIdInvalid,
+    FileReferenceExpired,
+    FileReferenceInvalid,
+    MessageIdInvalid,
+    ChannelPrivate,
+    ValueError,  # the stored file_id no longer decodes
+)
+TRANSIENT_ERRORS = (OSError, asyncio.TimeoutError, InternalServerError, ServiceUnavailable)
+
+# Source chats the bot recently failed to copy from (not a member, private, ...)
+_copy_denied: Dict[str, float] = {}
+# One download per partial file at a time: key -> [lock, users]
+_partial_locks: Dict[str, list] = {}
+
+
+def is_protected(chat_message) -> bool:
+    chat = chat_message.chat
+    return bool(chat_message.has_protected_content or (chat and chat.has_protected_content))
+
+
+async def copy_to_user(bot, chat_message, from_chat_id, to_chat_id) -> bool:
+    """
+    Deliver the source post with a server-side copy by the bot.
+
+    Only possible when the source allows forwarding and the bot itself can read
+    the chat (e.g. public channels). Returns False when the caller has to
+    download and upload the media instead.
+    """
+    if is_protected(chat_message):
+        return False
+    key = str(from_chat_id)
+    denied_at = _copy_denied.get(key)
+    if denied_at and time() - denied_at < COPY_DENIED_TTL:
+        return False
+
+    try:
+        if chat_message.media_group_id:
+            await bot.copy_media_group(to_chat_id, from_chat_id, chat_message.id)
+        else:
+            await bot.copy_message(to_chat_id, from_chat_id, chat_message.id)
+    except FloodWait as e:
+        metrics.incr("copy_transfers", outcome="fallback")
+        LOGGER(__name__).warning(f"Copy from {from_chat_id} hit FloodWait of {e.value}s, downloading instead")
+        return False
+    except Exception as e:
+        _copy_denied[key] = time()
+        metrics.incr("copy_transfers", outcome="fallback")
+        LOGGER(__name__).info(f"Bot cannot copy from {from_chat_id} ({e}), downloading instead")
+        return False
+
+    _copy_denied.pop(key, None)
+    metrics.incr("copy_transfers", outcome="copied")
+    LOGGER(__name__).info(f"Copied {from_chat_id}/{chat_message.id} server-side")
+    return True
+
+
+async def send_from_index(bot, chat_message, message, caption: str = "", wait_turn: Optional[Callable] = None) -> bool:
+    """Resend media this bot has delivered before by its file_id, without any transfer"""
+    unique_id = getattr(get_media_object(chat_message), "file_unique_id", None)
+    if not unique_id:
+        return False
+    entry = db.get_media_file(unique_id)
+    if not entry:
+        metrics.incr("media_index", result="miss")
+        return False
+
+    if wait_turn:
+        await wait_turn()
+    for attempt in range(INDEX_SEND_ATTEMPTS):
+        try:
+            await bot.send_cached_media(
+                message.chat.id, entry["file_id"], caption=caption or "", reply_to_message_id=message.id
+            )
+            break
+        except FloodWait as e:
+            LOGGER(__name__).warning(f"Cached send hit FloodWait of {e.value}s, transferring instead")
+            return False
+        except STALE_FILE_ERRORS as e:
+            # Telegram rejected the stored file_id, forget it so the next upload replaces it
+            db.delete_media_file(unique_id)
+            metrics.incr("media_index", result="invalid")
+            LOGGER(__name__).info(f"Cached file_id for {unique_id} rejected ({e}), removed from index")
+            return False
+        except TRANSIENT_ERRORS as e:
+            if attempt == INDEX_SEND_ATTEMPTS - 1:
+                raise
+            LOGGER(__name__).warning(f"Cached send of {unique_id} failed ({e}), retrying")
+            await asyncio.sleep(2 ** attempt)
+
+    metrics.incr("media_index", result="hit")
+    LOGGER(__name__).info(f"Served {unique_id} from media index")
+    return True
+
+
+def indexed_file_id(chat_message, media_type: str) -> Optional[str]:
+    """The bot's file_id for source media delivered before as the same media type"""
+    unique_id = getattr(get_media_object(chat_message), "file_unique_id", None)
+    if not unique_id:
+        return None
+    entry = db.get_media_file(unique_id)
+    if not entry or entry.get("media_type") != media_type:
+        metrics.incr("media_index", result="miss")
+        return None
+    metrics.incr("media_index", result="hit")
+    return entry["file_id"]
+
+
+def forget_delivery(chat_message):
+    """Drop an indexed file_id Telegram no longer accepts"""
+    unique_id = getattr(get_media_object(chat_message), "file_unique_id", None)
+    if unique_id:
+        db.delete_media_file(unique_id)
+        metrics.incr("media_index", result="invalid")
+
+
+def remember_delivery(chat_message, sent, media_type: str):
+    """Index the bot-side file_id of a successful upload under the source file_unique_id"""
+    source = get_media_object(chat_message)
+    delivered = get_media_object(sent)
+    if source is None or delivered is None or not getattr(source, "file_unique_id", None):
+        return
+    db.save_media_file(
+        source.file_unique_id, delivered.file_id, media_type,
+        chat_message.chat.id if chat_message.chat else None, chat_message.id
+    )
+
+
+def can_relay(chat_message) -> bool:
+    """Media that can go straight from the source to the bot without local processing"""
+    # Videos still need ffprobe and a thumbnail from the file on disk
+    if not (chat_message.photo or chat_message.document or chat_message.audio):
+        return False
+    size = get_media_size(chat_message)
+    return 0 < size <= MAX_UPLOAD_SIZE
+
+
+async def upload_stream(
+    bot,
+    chunks: AsyncIterator[bytes],
+    file_size: int,
+    file_name: str,
+    progress: Optional[Callable] = None,
+    progress_args: tuple = ()
+):
+    """Upload a stream of byte chunks of known total size and return the InputFile"""
+    is_big = file_size > BIG_FILE_THRESHOLD
+    file_id = bot.rnd_id()
+    total_parts = int(math.ceil(file_size / UPLOAD_PART_SIZE))
+    md5_sum = None if is_big else md5()
+
+    pending = bytearray()
+    part_index = 0
+    uploaded = 0
+
+    async def save_part(part: bytes):
+        nonlocal part_index, uploaded
+        if is_big:
+            rpc = raw.functions.upload.SaveBigFilePart(
+                file_id=file_id, file_part=part_index, file_total_parts=total_parts, bytes=part
+            )
+        else:
+            md5_sum.update(part)
+            rpc = raw.functions.upload.SaveFilePart(file_id=file_id, file_part=part_index, bytes=part)
+        if not await bot.invoke(rpc):
+            raise IOError(f"Telegram rejected upload part {part_index}")
+        part_index += 1
+        uploaded += len(part)
+        await _report(progress, uploaded, file_size, progress_args)
+
+    async for chunk in chunks:
+        pending += chunk
+        # Every part except the last must be exactly UPLOAD_PART_SIZE bytes
+        while len(pending) >= UPLOAD_PART_SIZE:
+            await save_part(bytes(pending[:UPLOAD_PART_SIZE]))
+            del pending[:UPLOAD_PART_SIZE]
+    if pending:
+        await save_part(bytes(pending))
+
+    if uploaded != file_size:
+        raise IOError(f"Stream ended after {uploaded} of {file_size} bytes")
+
+    if is_big:
+        return raw.types.InputFileBig(id=file_id, parts=total_parts, name=file_name)
+    return raw.types.InputFile(id=file_id, parts=total_parts, name=file_name, md5_checksum=md5_sum.hexdigest())
+
+
+async def send_uploaded_media(
+    bot,
+    chat_id: int,
+    media_type: str,
+    input_file,
+    caption: str = "",
+    mime_type: Optional[str] = None,
+    thumb: Optional[str] = None,
+    duration: int = 0,
+    width: int = 0,
+    height: int = 0,
+    performer: Optional[str] = None,
+    title: Optional[str] = None,
+    reply_to_message_id: Optional[int] = None
+):
+    """Send an already uploaded file as photo/video/audio/document, returns the sent message"""
+    if media_type == "photo":
+        media = raw.types.InputMediaUploadedPhoto(file=input_file)
+    else:
+        attributes = [raw.types.DocumentAttributeFilename(file_name=input_file.name)]
+        if media_type == "video":
+            attributes.append(raw.types.DocumentAttributeVideo(
+                duration=duration or 0, w=width or 0, h=height or 0, supports_streaming=True
+            ))
+        elif media_type == "audio":
+            attributes.append(raw.types.DocumentAttributeAudio(
+                duration=duration or 0, performer=performer, title=title
+            ))
+        media = raw.types.InputMediaUploadedDocument(
+            mime_type=mime_type or bot.guess_mime_type(input_file.name) or "application/octet-stream",
+            file=input_file,
+            thumb=await bot.save_file(thumb) if thumb else None,
+            attributes=attributes
+        )
+
+    r = await bot.invoke(
+        raw.functions.messages.SendMedia(
+            peer=await bot.resolve_peer(chat_id),
+            media=media,
+            random_id=bot.rnd_id(),
+            reply_to=raw.types.InputReplyToMessage(reply_to_msg_id=reply_to_message_id) if reply_to_message_id else None,
+            **await utils.parse_text_entities(bot, caption or "", None, None)
+        )
+    )
+    for update in r.updates:
+        if isinstance(update, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage)):
+            return await types.Message._parse(
+                bot, update.message,
+                {u.id: u for u in r.users},
+                {c.id: c for c in r.chats}
+            )
+    return None
+
+
+async def relay_media(
+    source_client,
+    bot,
+    chat_message,
+    message,
+    caption: str = "",
+    progress: Optional[Callable] = None,
+    progress_args: tuple = (),
+    wait_turn: Optional[Callable] = None
+):
+    """
+    Pipe media from the source chat to the user without writing it to disk.
+
+    The source client streams the file into a bounded buffer while the bot
+    uploads it part by part, so download and upload overlap and memory stays
+    at RELAY_BUFFER_CHUNKS MiB per transfer.
+    """
+    file_size = get_media_size(chat_message)
+    file_name = get_file_name(chat_message.id, chat_message) or str(chat_message.id)
+    buffer: asyncio.Queue = asyncio.Queue(maxsize=PyroConf.RELAY_BUFFER_CHUNKS)
+    stream_error: Optional[BaseException] = None
+
+    async def produce():
+        nonlocal stream_error
+        try:
+            async for chunk in source_client.stream_media(chat_message):
+                await buffer.put(chunk)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            stream_error = e
+        await buffer.put(None)
+
+    async def consume():
+        while True:
+            chunk = await buffer.get()
+            if chunk is None:
+                if stream_error:
+                    raise stream_error
+                return
+            yield chunk
+
+    producer = asyncio.create_task(produce())
+    try:
+        input_file = await upload_stream(bot, consume(), file_size, file_name, progress, progress_args)
+    finally:
+        if not producer.done():
+            producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
+
+    media_type = "photo" if chat_message.photo else "audio" if chat_message.audio else "document"
+    source = get_media_object(chat_message)
+    if wait_turn:
+        await wait_turn()
+    sent = await send_uploaded_media(
+        bot, message.chat.id, media_type, input_file, caption,
+        mime_type=getattr(source, "mime_type", None),
+        duration=getattr(source, "duration", 0),
+        performer=getattr(source, "performer", None),
+        title=getattr(source, "title", None),
+        reply_to_message_id=message.id
+    )
+    metrics.incr("relay_bytes", file_size)
+    LOGGER(__name__).info(f"Relayed {file_name} ({file_size} bytes) without touching disk")
+    return sent
+
+
+async def _report(progress: Optional[Callable], current: int, total: int, progress_args: tuple):
+    if not progress:
+        return
+    if inspect.iscoroutinefunction(progress):
+        await progress(current, total, *progress_args)
+    else:
+        progress(current, total, *progress_args)
+
+
+async def open_media_sessions(client, dc_id: int, count: int, auth_key: Optional[bytes] = None) -> List[Session]:
+    """
+    Start count media sessions of client to dc_id, authorized for the client's
+    account. Pass the auth_key of already authorized sessions to add more.
+    """
+    test_mode = await client.storage.test_mode()
+    home_dc = await client.storage.dc_id()
+    # Sessions to the same DC share one auth key, so authorization is imported once
+    authorize = False
+    if auth_key is None:
+        if dc_id == home_dc:
+            auth_key = await client.storage.auth_key()
+        else:
+            auth_key = await Auth(client, dc_id, test_mode).create()
+            authorize = True
+
+    sessions = []
+    try:
+        for _ in range(count):
+            session = Session(client, dc_id, auth_key, test_mode, is_media=True)
+            await session.start()
+            sessions.append(session)
+        if authorize:
+            exported = await client.invoke(raw.functions.auth.ExportAuthorization(dc_id=dc_id))
+            await sessions[0].invoke(
+                raw.functions.auth.ImportAuthorization(id=exported.id, bytes=exported.bytes)
+            )
+    except BaseException:
+        await close_media_sessions(sessions)
+        raise
+    return sessions
+
+
+async def close_media_sessions(sessions: List[Session]):
+    for session in sessions:
+        try:
+            await session.stop()
+        except Exception as e:
+            LOGGER(__name__).debug(f"Error stopping media session: {e}")
+
+
+class MediaSessions:
+    """
+    Authorized media sessions per client and DC, opened on first use and kept.
+
+    A session to a foreign DC needs its own auth key and an exported
+    authorization, a handshake that costs more than fetching most files.
+    Transfers of the same client share the sessions, more are added when a
+    transfer wants more connections, and all are closed with the client.
+    """
+
+    def __init__(self):
+        self._sessions: Dict[Tuple, List[Session]] = {}
+        self._locks: Dict[Tuple, asyncio.Lock] = {}
+
+    async def get(self, client, dc_id: int, count: int) -> List[Session]:
+        key = (client, dc_id)
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        async with lock:
+            sessions = self._sessions.get(key, [])
+            alive = [session for session in sessions if session.is_started.is_set()]
+            if len(alive) < len(sessions):
+                await close_media_sessions([session for session in sessions if session not in alive])
+            if len(alive) < count:
+                missing = count - len(alive)
+                auth_key = alive[0].auth_key if alive else None
+                alive += await open_media_sessions(client, dc_id, missing, auth_key)
+                metrics.incr("media_sessions_opened", missing, dc=dc_id)
+            self._sessions[key] = alive
+            return alive[:count]
+
+    async def close(self, client):
+        """Stop the client's media sessions, before the client itself is stopped"""
+        for key in [key for key in self._sessions if key[0] is client]:
+            self._locks.pop(key, None)
+            await close_media_sessions(self._sessions.pop(key))
+
+    async def close_all(self):
+        for client in {key[0] for key in self._sessions}:
+            await self.close(client)
+
+    def stats(self) -> Dict[str, int]:
+        return {"sessions": sum(len(sessions) for sessions in self._sessions.values())}
+
+
+def can_download_chunked(chat_message) -> bool:
+    """Non-photo media large enough to be worth chunked_download's extra connections"""
+    if not (chat_message.video or chat_message.document or chat_message.audio):
+        return False
+    return get_media_size(chat_message) >= PARALLEL_MIN_SIZE
+
+
+class DownloadCheckpoint:
+    """
+    Sidecar file recording which chunks of a partial download are on disk.
+
+    Partial downloads live under the storage partial dir keyed by file_unique_id, so a
+    retry, a re-request or a restarted process continues where the last
+    attempt stopped. Chunks are only recorded after the data was fsynced.
+    """
+
+    def __init__(self, unique_id: str, file_size: int):
+        self.file_size = file_size
+        self.unique_id = unique_id
+        base = os.path.join(storage.partial_dir, "".join(c for c in unique_id if c.isalnum() or c in "-_"))
+        self.data_path = f"{base}.temp"
+        self.sidecar_path = f"{base}.parts"
+        self.done = set()
+        self._last_save = 0.0
+
+    def load(self):
+        os.makedirs(storage.partial_dir, exist_ok=True)
+        try:
+            with open(self.sidecar_path) as f:
+                state = json.load(f)
+            if (state.get("size") == self.file_size and state.get("chunk_size") == DOWNLOAD_CHUNK_SIZE
+                    and os.path.getsize(self.data_path) == self.file_size):
+                self.done = set(state.get("done", []))
+                return
+        except (OSError, ValueError):
+            pass
+        # Nothing usable to resume from, start a fresh preallocated file
+        with open(self.data_path, "wb") as f:
+            f.truncate(self.file_size)
+        self.done = set()
+
+    def save(self, fd: int, force: bool = False):
+        if not force and time() - self._last_save < 2:
+            return
+        os.fsync(fd)
+        tmp_path = f"{self.sidecar_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"size": self.file_size, "chunk_size": DOWNLOAD_CHUNK_SIZE, "done": sorted(self.done)}, f)
+        os.replace(tmp_path, self.sidecar_path)
+        self._last_save = time()
+
+    def finish(self, file_path: str):
+        # A move, not a rename: small jobs may have their workspace on tmpfs
+        shutil.move(self.data_path, file_path)
+        try:
+            os.remove(self.sidecar_path)
+        except FileNotFoundError:
+            pass
+
+
+@asynccontextmanager
+async def _partial_lock(key: str):
+    entry = _partial_locks.setdefault(key, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            _partial_locks.pop(key, None)
+
+
+async def chunked_download(
+    client,
+    chat_message,
+    file_path: str,
+    progress: Optional[Callable] = None,
+    progress_args: tuple = ()
+) -> str:
+    """
+    Download media in 1 MiB chunks into a resumable, preallocated partial file.
+
+    The file is fetched over DOWNLOAD_CONNECTIONS shared media sessions to its
+    DC at once (see can_download_chunked). Completed chunks are checkpointed, so after an
+    error the next call only fetches what is missing. The file is moved to
+    file_path once every chunk is in place.
+    """
+    media = get_media_object(chat_message)
+    file_size = media.file_size
+    file_id = FileId.decode(media.file_id)
+    location = raw.types.InputDocumentFileLocation(
+        id=file_id.media_id,
+        access_hash=file_id.access_hash,
+        file_reference=file_id.file_reference,
+        thumb_size=""
+    )
+
+    total_chunks = int(math.ceil(file_size / DOWNLOAD_CHUNK_SIZE))
+    connections = max(min(PyroConf.DOWNLOAD_CONNECTIONS, total_chunks), 1)
+
+    async with _partial_lock(media.file_unique_id):
+        checkpoint = DownloadCheckpoint(media.file_unique_id, file_size)
+        checkpoint.load()
+        if checkpoint.done:
+            LOGGER(__name__).info(f"Resuming {media.file_unique_id} with {len(checkpoint.done)}/{total_chunks} chunks done")
+            metrics.incr("download_resumed")
+        downloaded = min(len(checkpoint.done) * DOWNLOAD_CHUNK_SIZE, file_size)
+        fd = os.open(checkpoint.data_path, os.O_WRONLY)
+
+        async def worker(session: Session, pending):
+            nonlocal downloaded
+            for index in pending:
+                offset = index * DOWNLOAD_CHUNK_SIZE
+                r = await session.invoke(
+                    raw.functions.upload.GetFile(location=location, offset=offset, limit=DOWNLOAD_CHUNK_SIZE),
+                    sleep_threshold=30
+                )
+                if not isinstance(r, raw.types.upload.File):
+                    raise IOError("file is served from a CDN")
+                expected = min(DOWNLOAD_CHUNK_SIZE, file_size - offset)
+                if len(r.bytes) != expected:
+                    raise IOError(f"chunk {index} returned {len(r.bytes)} of {expected} bytes")
+                os.pwrite(fd, r.bytes, offset)
+                checkpoint.done.add(index)
+                checkpoint.save(fd)
+                downloaded += len(r.bytes)
+                await _report(progress, downloaded, file_size, progress_args)
+
+        dc_id = file_id.dc_id
+        start = time()
+        try:
+            for _ in range(3):
+                pending = iter([i for i in range(total_chunks) if i not in checkpoint.done])
+                sessions = await media_sessions.get(client, dc_id, connections)
+                tasks = [asyncio.create_task(worker(session, pending)) for session in sessions]
+                try:
+                    await asyncio.gather(*tasks)
+                    break
+                except RPCError as e:
+                    if e.ID != "FILE_MIGRATE_X":
+                        raise
+                    # The file lives on another DC than its file_id says, follow it
+                    LOGGER(__name__).info(f"File {media.file_unique_id} migrated to DC {e.value}")
+                    dc_id = e.value
+                finally:
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+            else:
+                raise IOError("file kept migrating between DCs")
+        finally:
+            # Keep whatever arrived so the next attempt can resume
+            try:
+                checkpoint.save(fd, force=True)
+            finally:
+                os.close(fd)
+
+        checkpoint.finish(file_path)
+
+    elapsed = time() - start
+    metrics.observe("chunked_download_time", elapsed, connections=connections)
+    LOGGER(__name__).info(
+        f"Downloaded {file_size} bytes over {connections} connection(s) in {elapsed:.1f}s "
+        f"({file_size / max(elapsed, 0.001) / 1024**2:.1f} MiB/s)"
+    )
+    return file_path
+
+
+def can_upload_parallel(file_size: int) -> bool:
+    return PyroConf.UPLOAD_CONNECTIONS > 1 and BIG_FILE_THRESHOLD < file_size <= MAX_UPLOAD_SIZE
+
+
+async def parallel_upload(
+    bot,
+    file_path: str,
+    progress: Optional[Callable] = None,
+    progress_args: tuple = (),
+    part_retries: int = 3
+):
+    """
+    Upload a big file with SaveBigFilePart over several media connections.
+
+    Each connection has one part in flight, so at most UPLOAD_CONNECTIONS parts
+    are held in memory. A failed part is retried on its own with backoff before
+    the whole upload is given up. Returns the InputFileBig to send.
+    """
+    file_size = os.path.getsize(file_path)
+    file_name = os.path.basename(file_path)
+    file_id = bot.rnd_id()
+    total_parts = int(math.ceil(file_size / UPLOAD_PART_SIZE))
+    pending = iter(range(total_parts))
+    uploaded = 0
+
+    async def save_part(session: Session, index: int, part: bytes):
+        error = None
+        for attempt in range(part_retries):
+            # Flood waits are waited out without using up an attempt
+            while True:
+                try:
+                    ok = await session.invoke(
+                        raw.functions.upload.SaveBigFilePart(
+                            file_id=file_id, file_part=index, file_total_parts=total_parts, bytes=part
+                        )
+                    )
+                    if ok:
+                        return
+                    error = IOError(f"Telegram rejected upload part {index}")
+                except FloodWait as e:
+                    await asyncio.sleep(e.value)
+                    continue
+                except TRANSIENT_ERRORS as e:
+                    error = e
+                break
+            if attempt < part_retries - 1:
+                metrics.incr("upload_part_retries")
+                await asyncio.sleep(2 ** attempt)
+        raise IOError(f"Upload part {index} failed after {part_retries} attempts: {error}")
+
+    async def worker(session: Session, fd: int):
+        nonlocal uploaded
+        for index in pending:
+            part = os.pread(fd, UPLOAD_PART_SIZE, index * UPLOAD_PART_SIZE)
+            await save_part(session, index, part)
+            uploaded += len(part)
+            await _report(progress, uploaded, file_size, progress_args)
+
+    connections = min(PyroConf.UPLOAD_CONNECTIONS, total_parts)
+    start = time()
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        sessions = await media_sessions.get(bot, await bot.storage.dc_id(), connections)
+        tasks = [asyncio.create_task(worker(session, fd)) for session in sessions]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        os.close(fd)
+
+    elapsed = time() - start
+    metrics.observe("parallel_upload_time", elapsed, connections=connections)
+    LOGGER(__name__).info(
+        f"Uploaded {file_size} bytes over {connections} connections in {elapsed:.1f}s "
+        f"({file_size / max(elapsed, 0.001) / 1024**2:.1f} MiB/s)"
+    )
+    return raw.types.InputFileBig(id=file_id, parts=total_parts, name=file_name)
+
+
+media_sessions = MediaSessions()
@@ -1,14 +1,22 @@
 # Copyright (C) @TheSmartBisnu
 
 import os
+import heapq
+import shutil
+from contextvars import ContextVar
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 from time import time
 from PIL import Image
 from logger import LOGGER
-from typing import Optional
+from config import PyroConf
+from metrics import metrics
+from typing import Dict, Optional, Tuple
+from collections import OrderedDict
 from asyncio.subprocess import PIPE
-from asyncio import create_subprocess_exec, create_subprocess_shell, wait_for
+from asyncio import TimeoutError as AsyncTimeoutError
+from asyncio import CancelledError, Lock, Semaphore, get_running_loop, create_subprocess_exec, create_subprocess_shell, gather, wait_for
 
-from pyleaves import Leaves
 from pyrogram.parser import Parser
 from pyrogram.utils import get_channel_id
 from pyrogram.types import (
@@ -16,18 +24,82 @@ from pyrogram.types import (
     InputMediaVideo,
     InputMediaDocument,
     InputMediaAudio,
-    Voice,
 )
 
 from helpers.files import (
     fileSizeLimit,
-    cleanup_download
+    cleanup_download,
+    disk_budget,
+    media_cache
 )
 
 from helpers.msg import (
-    get_parsed_msg
+    get_parsed_msg,
+    get_file_name,
+    get_media_size,
+    get_media_object
 )
 
+from database import db
+from helpers.status import status_messages
+from helpers.storage import storage
+from helpers.progress import progress_hub
+from helpers.transfer import (
+    can_upload_parallel,
+    parallel_upload,
+    send_uploaded_media,
+    indexed_file_id,
+    remember_delivery,
+    forget_delivery,
+    STALE_FILE_ERRORS
+)
+
+# JPEG qualities tried for thumbnails, best first
+THUMB_QUALITIES = (95, 85, 75, 65, 55, 45, 35, 25, 15)
+
+# PIL releases the GIL while resizing and encoding, so a small pool keeps it off the loop
+_image_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="thumbs")
+
+
+def _encode_jpeg(img, quality: int) -> BytesIO:
+    buffer = BytesIO()
+    img.save(buffer, 'JPEG', quality=quality, optimize=True)
+    return buffer
+
+
+def _compress_thumbnail(thumb_path, max_size_kb) -> bool:
+    max_bytes = max_size_kb * 1024
+    with Image.open(thumb_path) as img:
+        # Convert to RGB (remove alpha channel if present)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        # Resize to fit within 320x320 while maintaining aspect ratio
+        img.thumbnail((320, 320), Image.Resampling.LANCZOS)
+
+        # Most thumbnails fit at the top quality; otherwise binary search for the
+        # best quality that fits, encoding in memory only
+        best = _encode_jpeg(img, THUMB_QUALITIES[0])
+        if best.tell() > max_bytes:
+            best = None
+            low, high = 1, len(THUMB_QUALITIES) - 1
+            while low <= high:
+                middle = (low + high) // 2
+                buffer = _encode_jpeg(img, THUMB_QUALITIES[middle])
+                if buffer.tell() <= max_bytes:
+                    best, high = buffer, middle - 1
+                else:
+                    low = middle + 1
+
+    if best is None:
+        LOGGER(__name__).warning(f"Thumbnail still over {max_size_kb} KB at quality {THUMB_QUALITIES[-1]}")
+        return False
+
+    with open(thumb_path, "wb") as f:
+        f.write(best.getbuffer())
+    return True
+
+
 async def process_thumbnail(thumb_path, max_size_kb=200):
     """
     Process thumbnail to meet Telegram requirements:
@@ -36,50 +108,106 @@ async def process_thumbnail(thumb_path, max_size_kb=200):
     - Max 320px width/height
     """
     try:
-        with Image.open(thumb_path) as img:
-            # Convert to RGB (remove alpha channel if present)
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            # Resize to fit within 320x320 while maintaining aspect ratio
-            img.thumbnail((320, 320), Image.Resampling.LANCZOS)
-            
-            # Save with compression, iteratively reduce quality if needed
-            quality = 95
-            while quality > 10:
-                img.save(thumb_path, 'JPEG', quality=quality, optimize=True)
-                
-                # Check file size
-                file_size_kb = os.path.getsize(thumb_path) / 1024
-                if file_size_kb <= max_size_kb:
-                    return True
-                
-                quality -= 10
-            
-            # If still too large after minimum quality, return False
-            file_size_kb = os.path.getsize(thumb_path) / 1024
-            if file_size_kb > max_size_kb:
-                LOGGER(__name__).warning(f"Thumbnail still {file_size_kb:.2f} KB after compression")
-                return False
-            
-            return True
+        return await get_running_loop().run_in_executor(_image_pool, _compress_thumbnail, thumb_path, max_size_kb)
     except Exception as e:
         LOGGER(__name__).error(f"Error processing thumbnail: {e}")
         return False
 
-# Progress bar template
-PROGRESS_BAR = """
-Percentage: {percentage:.2f}% | {current}/{total}
-Speed: {speed}/s
-Estimated Time Left: {est_time} seconds
-"""
-
-async def cmd_exec(cmd, shell=False):
-    if shell:
-        proc = await create_subprocess_shell(cmd, stdout=PIPE, stderr=PIPE)
-    else:
-        proc = await create_subprocess_exec(*cmd, stdout=PIPE, stderr=PIPE)
-    stdout, stderr = await proc.communicate()
+# Lower runs first; batch jobs yield the media tools to single downloads
+MEDIA_PRIORITY_INTERACTIVE = 0
+MEDIA_PRIORITY_BATCH = 10
+
+# Set by callers (e.g. /bdl) around the tasks they start; copied into each task's context
+media_priority: "ContextVar[int]" = ContextVar("media_priority", default=MEDIA_PRIORITY_INTERACTIVE)
+
+
+class MediaToolExecutor:
+    """
+    Runs ffmpeg/ffprobe with a process-wide cap sized to the CPU.
+
+    Waiting calls are started by priority, then in arrival order. Every call
+    has a timeout, and the process is killed when it times out or the calling
+    job is cancelled. ffmpeg gets an even share of the cores as its thread count.
+    """
+
+    def __init__(self, max_procs: int = 0, default_timeout: float = 120):
+        cpus = os.cpu_count() or 2
+        self.max_procs = max_procs or max(1, cpus // 2)
+        self.threads = max(1, cpus // self.max_procs)
+        self.default_timeout = default_timeout
+        self._running = 0
+        self._waiters = []
+        self._seq = 0
+
+    async def _acquire(self, priority: int):
+        if self._running < self.max_procs and not self._waiters:
+            self._running += 1
+            return
+        future = get_running_loop().create_future()
+        self._seq += 1
+        heapq.heappush(self._waiters, (priority, self._seq, future))
+        try:
+            await future
+        except CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we were cancelled
+                self._release()
+            raise
+
+    def _release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)  # the slot passes straight to the waiter
+                return
+        self._running -= 1
+
+    async def run(self, cmd, shell=False, timeout: Optional[float] = None, priority: Optional[int] = None):
+        tool = os.path.basename(cmd.split()[0] if shell else cmd[0])
+        queued = time()
+        await self._acquire(media_priority.get() if priority is None else priority)
+
+        started = time()
+        metrics.observe("media_tool_wait", started - queued, tool=tool)
+        outcome = "ok"
+        proc = None
+        try:
+            if shell:
+                proc = await create_subprocess_shell(cmd, stdout=PIPE, stderr=PIPE)
+            else:
+                proc = await create_subprocess_exec(*cmd, stdout=PIPE, stderr=PIPE)
+            stdout, stderr = await wait_for(proc.communicate(), timeout or self.default_timeout)
+            return stdout, stderr, proc.returncode
+        except AsyncTimeoutError:
+            outcome = "timeout"
+            LOGGER(__name__).warning(f"{tool} timed out after {time() - started:.0f}s, killing it")
+            raise
+        except CancelledError:
+            outcome = "cancelled"
+            raise
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            if proc and proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            self._release()
+            metrics.observe("media_tool", time() - started, tool=tool, outcome=outcome)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "running": self._running,
+            "waiting": sum(1 for _, _, future in self._waiters if not future.done()),
+            "max_procs": self.max_procs,
+        }
+
+
+media_tools = MediaToolExecutor(PyroConf.MEDIA_TOOL_CONCURRENCY)
+
+
+async def cmd_exec(cmd, shell=False, timeout: Optional[float] = None):
+    stdout, stderr, returncode = await media_tools.run(cmd, shell, timeout)
     try:
         stdout = stdout.decode().strip()
     except:
@@ -88,7 +216,7 @@ async def cmd_exec(cmd, shell=False):
         stderr = stderr.decode().strip()
     except:
         stderr = "Unable to decode the error!"
-    return stdout, stderr, proc.returncode
+    return stdout, stderr, returncode
 
 
 async def get_media_info(path):
@@ -96,7 +224,7 @@ async def get_media_info(path):
         result = await cmd_exec([
             "ffprobe", "-hide_banner", "-loglevel", "error",
             "-print_format", "json", "-show_format", "-show_streams", path,
-        ])
+        ], timeout=30)
     except Exception as e:
         print(f"Get Media Info: {e}. Mostly File not found! - File: {path}")
         return 0, None, None
@@ -146,8 +274,47 @@ async def get_media_info(path):
     return 0, None, None
 
 
-async def get_video_thumbnail(video_file, duration):
-    output = os.path.join("Assets", "video_thumb.jpg")
+# ffprobe results by source file_unique_id, so the same media is probed once
+PROBE_CACHE_SIZE = 1024
+_probe_cache: "OrderedDict[str, Tuple[int, Optional[str], Optional[str]]]" = OrderedDict()
+
+
+async def probe_media(path, unique_id: Optional[str] = None):
+    """get_media_info, cached by the source file_unique_id when one is given"""
+    if unique_id and unique_id in _probe_cache:
+        _probe_cache.move_to_end(unique_id)
+        return _probe_cache[unique_id]
+    info = await get_media_info(path)
+    if unique_id and info[0]:
+        _probe_cache[unique_id] = info
+        if len(_probe_cache) > PROBE_CACHE_SIZE:
+            _probe_cache.popitem(last=False)
+    return info
+
+
+async def get_media_metadata(media_path, media_type: str, source_message=None) -> Dict:
+    """
+    Duration, dimensions and audio tags for an upload, taken from the source
+    message and only probed with ffprobe when the source lacks a duration
+    """
+    media = getattr(source_message, media_type, None) if source_message else None
+    metadata = {
+        "duration": getattr(media, "duration", 0) or 0,
+        "width": getattr(media, "width", 0) or 0,
+        "height": getattr(media, "height", 0) or 0,
+        "performer": getattr(media, "performer", None),
+        "title": getattr(media, "title", None),
+    }
+    if not metadata["duration"] and media_type in ("video", "audio"):
+        duration, artist, title = await probe_media(media_path, getattr(media, "file_unique_id", None))
+        metadata["duration"] = duration
+        metadata["performer"] = metadata["performer"] or artist
+        metadata["title"] = metadata["title"] or title
+    return metadata
+
+
+async def get_video_thumbnail(video_file, duration, output=None):
+    output = output or os.path.join("Assets", "video_thumb.jpg")
     if duration is None:
         duration = (await get_media_info(video_file))[0]
     if not duration:
@@ -157,320 +324,460 @@ async def get_video_thumbnail(video_file, duration):
         "ffmpeg", "-hide_banner", "-loglevel", "error",
         "-ss", str(duration), "-i", video_file,
         "-vf", "thumbnail", "-q:v", "1", "-frames:v", "1",
-        "-threads", str((os.cpu_count() or 4) // 2), output,
+        "-threads", str(media_tools.threads), output,
     ]
     try:
-        _, err, code = await wait_for(cmd_exec(cmd), timeout=60)
+        _, err, code = await cmd_exec(cmd, timeout=60)
         if code != 0 or not os.path.exists(output):
             return None
-    except:
+    except CancelledError:
+        raise
+    except Exception:
         return None
     return output
 
 
-# Generate progress bar for downloading/uploading
+class ThumbnailCache:
+    """
+    Processed custom thumbnails, one per user, keyed by the thumbnail file_id.
+
+    The Telegram-compliant JPEG is made once and reused for every upload until
+    the user changes or deletes the thumbnail. At most max_entries users are
+    kept, least recently used first out. Files are derived data, so the
+    directory is emptied on start.
+    """
+
+    def __init__(self, root_dir: str, max_entries: int = 500):
+        self.root_dir = root_dir
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, Tuple[str, str]]" = OrderedDict()
+        self._locks: Dict[int, Lock] = {}
+        shutil.rmtree(root_dir, ignore_errors=True)
+
+    def _lock_for(self, user_id: int) -> Lock:
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = Lock()
+        return lock
+
+    async def get(self, bot, user_id: int, file_id: str) -> Optional[str]:
+        """Path of the user's processed thumbnail; shared, callers must not delete it"""
+        async with self._lock_for(user_id):
+            entry = self._entries.get(user_id)
+            if entry and entry[0] == file_id and os.path.exists(entry[1]):
+                self._entries.move_to_end(user_id)
+                return entry[1]
+
+            self.invalidate(user_id)
+            os.makedirs(self.root_dir, exist_ok=True)
+            path = os.path.join(self.root_dir, f"user_{user_id}_{int(time() * 1000)}.jpg")
+            path = await bot.download_media(file_id, file_name=path)
+            if not await process_thumbnail(path):
+                if os.path.exists(path):
+                    os.remove(path)
+                return None
+
+            self._entries[user_id] = (file_id, path)
+            while len(self._entries) > self.max_entries:
+                _, (_, old_path) = self._entries.popitem(last=False)
+                if os.path.exists(old_path):
+                    os.remove(old_path)
+            return path
+
+    def invalidate(self, user_id: int):
+        """Forget the user's processed thumbnail (on /setthumb and /delthumb)"""
+        entry = self._entries.pop(user_id, None)
+        if entry and os.path.exists(entry[1]):
+            try:
+                os.remove(entry[1])
+            except OSError:
+                pass
+
+
+thumbnail_cache = ThumbnailCache(os.path.join(storage.thumbs_dir, "cache"))
+
+
+class VideoThumbnail:
+    """
+    Thumbnail candidates for one video upload, best first: the user's custom
+    thumbnail, the source message's Telegram thumbnail (a few KB), then a frame
+    extracted with ffmpeg. next() moves on to the next candidate, e.g. after
+    Telegram rejected the previous one, and returns None when none is left.
+    """
+
+    def __init__(self, bot, media_path, duration, user_id=None, source_message=None):
+        self.bot = bot
+        self.media_path = media_path
+        self.duration = duration
+        self.user_id = user_id
+        self.source_message = source_message
+        self.stages = [self._custom, self._source, self._extracted]
+        self.paths = []
+
+    async def next(self) -> Optional[str]:
+        while self.stages:
+            stage = self.stages.pop(0)
+            try:
+                path = await stage()
+            except CancelledError:
+                raise
+            except Exception as e:
+                LOGGER(__name__).warning(f"Thumbnail stage {stage.__name__} failed: {e}")
+                path = None
+            if path:
+                return path
+        return None
+
+    def _temp_path(self, kind: str) -> str:
+        path = os.path.join(storage.thumbs_dir, f"{kind}_{self.user_id or 0}_{int(time() * 1000)}.jpg")
+        self.paths.append(path)
+        return path
+
+    async def _custom(self) -> Optional[str]:
+        file_id = db.get_custom_thumbnail(self.user_id) if self.user_id else None
+        if not file_id:
+            return None
+        path = await thumbnail_cache.get(self.bot, self.user_id, file_id)
+        if not path:
+            LOGGER(__name__).warning(f"Failed to process custom thumbnail for user {self.user_id}, will try fallback")
+            return None
+        LOGGER(__name__).info(f"Using custom thumbnail for user {self.user_id}")
+        return path
+
+    async def _source(self) -> Optional[str]:
+        thumbs = getattr(getattr(self.source_message, "video", None), "thumbs", None)
+        if not thumbs:
+            return None
+        # The source thumbnail belongs to the source chat, so the source client fetches it
+        largest = max(thumbs, key=lambda t: (t.width or 0) * (t.height or 0))
+        path = await self.source_message._client.download_media(largest.file_id, file_name=self._temp_path("src"))
+        self.paths.append(path)
+        return path if await process_thumbnail(path) else None
+
+    async def _extracted(self) -> Optional[str]:
+        return await get_video_thumbnail(self.media_path, self.duration, self._temp_path("fb"))
+
+    def cleanup(self):
+        for path in set(self.paths):
+            if path and os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+# Progress callback arguments for progress_hub.update
 def progressArgs(action: str, progress_message, start_time):
-    return (action, progress_message, start_time, PROGRESS_BAR, "▓", "░")
+    return (action, progress_message, start_time)
 
 
 async def send_media(
-    bot, message, media_path, media_type, caption, progress_message, start_time, user_id=None
+    bot, message, media_path, media_type, caption, progress_message, start_time, user_id=None, source_message=None
 ):
+    """
+    Upload a downloaded file to the user, returns the sent message. Duration,
+    dimensions and tags come from source_message when given.
+    """
     file_size = os.path.getsize(media_path)
 
     if not await fileSizeLimit(file_size, message, "upload"):
-        return
+        return None
 
-    progress_args = progressArgs("📥 Uploading Progress", progress_message, start_time)
+    progress_args = progressArgs("📤 Uploading Progress", progress_message, start_time)
     LOGGER(__name__).info(f"Uploading media: {media_path} ({media_type})")
 
+    # Big files are uploaded once over parallel connections, then sent (and
+    # re-sent on thumbnail fallbacks) from the uploaded InputFile
+    input_file = None
+    if media_type != "photo" and can_upload_parallel(file_size):
+        try:
+            input_file = await parallel_upload(
+                bot, media_path, progress_hub.update, progress_args
+            )
+        except CancelledError:
+            raise
+        except Exception as e:
+            LOGGER(__name__).warning(f"Parallel upload failed, using regular upload: {e}")
+
+    async def reply_video(video_kwargs):
+        if input_file:
+            return await send_uploaded_media(
+                bot, message.chat.id, "video", input_file, video_kwargs["caption"],
+                thumb=video_kwargs.get("thumb"),
+                duration=video_kwargs.get("duration", 0),
+                width=video_kwargs["width"],
+                height=video_kwargs["height"],
+                reply_to_message_id=message.id,
+            )
+        return await message.reply_video(media_path, **video_kwargs)
+
+    sent = None
     if media_type == "photo":
-        await message.reply_photo(
+        sent = await message.reply_photo(
             media_path,
             caption=caption or "",
-            progress=Leaves.progress_for_pyrogram,
+            progress=progress_hub.update,
             progress_args=progress_args,
         )
     elif media_type == "video":
-        # Check for custom thumbnail first
-        thumb = None
-        custom_thumb_path = None
-        fallback_thumb = None
-        
-        if user_id:
-            from database import db
-            custom_thumb_file_id = db.get_custom_thumbnail(user_id)
-            if custom_thumb_file_id:
-                try:
-                    # Use unique temp path to avoid race conditions
-                    import time as time_module
-                    timestamp = int(time_module.time() * 1000)
-                    os.makedirs("Assets/thumbs", exist_ok=True)
-                    custom_thumb_path = f"Assets/thumbs/user_{user_id}_{timestamp}.jpg"
-                    
-                    # Download the thumbnail from Telegram
-                    await bot.download_media(custom_thumb_file_id, file_name=custom_thumb_path)
-                    
-                    # Process thumbnail to meet Telegram requirements
-                    if await process_thumbnail(custom_thumb_path):
-                        thumb = custom_thumb_path
-                        LOGGER(__name__).info(f"Using custom thumbnail for user {user_id}")
-                    else:
-                        LOGGER(__name__).warning(f"Failed to process custom thumbnail for user {user_id}, will try fallback")
-                        thumb = None
-                except Exception as e:
-                    LOGGER(__name__).error(f"Failed to download custom thumbnail for user {user_id}: {e}")
-                    thumb = None
-        
-        # Get video duration
-        duration = (await get_media_info(media_path))[0]
-        
-        # If no custom thumbnail, prepare unique fallback thumbnail
-        if not thumb:
-            import time as time_module
-            timestamp = int(time_module.time() * 1000)
-            os.makedirs("Assets/thumbs", exist_ok=True)
-            fallback_thumb = f"Assets/thumbs/fb_{user_id or 0}_{timestamp}.jpg"
-            
-            # Extract thumbnail from video to unique path
-            cmd = [
-                "ffmpeg", "-hide_banner", "-loglevel", "error",
-                "-ss", str(duration // 2 if duration else 3), "-i", media_path,
-                "-vf", "thumbnail", "-q:v", "1", "-frames:v", "1",
-                "-threads", str((os.cpu_count() or 4) // 2), fallback_thumb,
-            ]
-            try:
-                _, err, code = await wait_for(cmd_exec(cmd), timeout=60)
-                if code == 0 and os.path.exists(fallback_thumb):
-                    thumb = fallback_thumb
-                else:
-                    thumb = None
-            except:
-                thumb = None
-        
-        # Get video dimensions
-        if thumb and thumb != "none" and os.path.exists(str(thumb)):
-            try:
-                with Image.open(thumb) as img:
-                    width, height = img.size
-            except:
-                width = 480
-                height = 320
-        else:
-            width = 480
-            height = 320
-
-        if thumb == "none":
-            thumb = None
-
-        # Try uploading with thumbnail, fallback on error
-        # Only include duration if > 0, otherwise let Telegram compute it
-        video_kwargs = {
-            "width": width,
-            "height": height,
-            "thumb": thumb,
-            "caption": caption or "",
-            "progress": Leaves.progress_for_pyrogram,
-            "progress_args": progress_args,
-        }
-        if duration > 0:
-            video_kwargs["duration"] = duration
-        
+        metadata = await get_media_metadata(media_path, "video", source_message)
+        duration = metadata["duration"]
+        thumbnail = VideoThumbnail(bot, media_path, duration, user_id, source_message)
         try:
-            await message.reply_video(media_path, **video_kwargs)
-        except Exception as e:
-            # If thumbnail causes error, try with fallback or no thumb
-            LOGGER(__name__).error(f"Upload failed with thumbnail: {e}")
-            
-            # If custom thumbnail was used, generate fallback now
-            if custom_thumb_path and not fallback_thumb:
-                LOGGER(__name__).info("Custom thumbnail failed, generating fallback thumbnail")
-                try:
-                    import time as time_module
-                    timestamp = int(time_module.time() * 1000)
-                    fallback_thumb = f"Assets/thumbs/fb_{user_id or 0}_{timestamp}.jpg"
-                    
-                    cmd = [
-                        "ffmpeg", "-hide_banner", "-loglevel", "error",
-                        "-ss", str(duration // 2 if duration else 3), "-i", media_path,
-                        "-vf", "thumbnail", "-q:v", "1", "-frames:v", "1",
-                        "-threads", str((os.cpu_count() or 4) // 2), fallback_thumb,
-                    ]
-                    _, err, code = await wait_for(cmd_exec(cmd), timeout=60)
-                    if code != 0 or not os.path.exists(fallback_thumb):
-                        fallback_thumb = None
-                except:
-                    fallback_thumb = None
-            
-            # Try with fallback thumbnail
-            if fallback_thumb:
-                LOGGER(__name__).info("Retrying with auto-extracted thumbnail")
+            thumb = await thumbnail.next()
+
+            # Get video dimensions, from the thumbnail when the source has none
+            width, height = metadata["width"], metadata["height"]
+            if not (width and height):
+                width, height = 480, 320
+                if thumb:
+                    try:
+                        with Image.open(thumb) as img:
+                            width, height = img.size
+                    except Exception:
+                        pass
+
+            # Only include duration if > 0, otherwise let Telegram compute it
+            video_kwargs = {
+                "width": width,
+                "height": height,
+                "thumb": thumb,
+                "caption": caption or "",
+                "progress": progress_hub.update,
+                "progress_args": progress_args,
+            }
+            if duration > 0:
+                video_kwargs["duration"] = duration
+
+            # Try the next thumbnail candidate, and finally none, if Telegram rejects one
+            while True:
                 try:
-                    video_kwargs["thumb"] = fallback_thumb
-                    await message.reply_video(media_path, **video_kwargs)
-                except Exception as e2:
-                    LOGGER(__name__).error(f"Upload failed with fallback: {e2}, trying without thumbnail")
-                    video_kwargs["thumb"] = None
-                    await message.reply_video(media_path, **video_kwargs)
-            else:
-                LOGGER(__name__).info("Retrying without thumbnail")
-                video_kwargs["thumb"] = None
-                await message.reply_video(media_path, **video_kwargs)
-        
-        # Clean up thumbnails after upload
-        if custom_thumb_path and os.path.exists(custom_thumb_path):
-            try:
-                os.remove(custom_thumb_path)
-            except:
-                pass
-        if fallback_thumb and os.path.exists(fallback_thumb):
-            try:
-                os.remove(fallback_thumb)
-            except:
-                pass
+                    sent = await reply_video(video_kwargs)
+                    break
+                except CancelledError:
+                    raise
+                except Exception as e:
+                    if video_kwargs["thumb"] is None:
+                        raise
+                    LOGGER(__name__).error(f"Upload failed with thumbnail: {e}")
+                    video_kwargs["thumb"] = await thumbnail.next()
+                    LOGGER(__name__).info(
+                        "Retrying with next thumbnail" if video_kwargs["thumb"] else "Retrying without thumbnail"
+                    )
+        finally:
+            thumbnail.cleanup()
     elif media_type == "audio":
-        duration, artist, title = await get_media_info(media_path)
-        await message.reply_audio(
-            media_path,
-            duration=duration,
-            performer=artist,
-            title=title,
-            caption=caption or "",
-            progress=Leaves.progress_for_pyrogram,
-            progress_args=progress_args,
-        )
+        metadata = await get_media_metadata(media_path, "audio", source_message)
+        duration, artist, title = metadata["duration"], metadata["performer"], metadata["title"]
+        if input_file:
+            sent = await send_uploaded_media(
+                bot, message.chat.id, "audio", input_file, caption,
+                duration=duration, performer=artist, title=title,
+                reply_to_message_id=message.id,
+            )
+        else:
+            sent = await message.reply_audio(
+                media_path,
+                duration=duration,
+                performer=artist,
+                title=title,
+                caption=caption or "",
+                progress=progress_hub.update,
+                progress_args=progress_args,
+            )
     elif media_type == "document":
-        await message.reply_document(
-            media_path,
-            caption=caption or "",
-            progress=Leaves.progress_for_pyrogram,
-            progress_args=progress_args,
-        )
+        if input_file:
+            sent = await send_uploaded_media(
+                bot, message.chat.id, "document", input_file, caption, reply_to_message_id=message.id
+            )
+        else:
+            sent = await message.reply_document(
+                media_path,
+                caption=caption or "",
+                progress=progress_hub.update,
+                progress_args=progress_args,
+            )
+    return sent
 
 
-async def processMediaGroup(chat_message, bot, message):
+async def processMediaGroup(chat_message, bot, message, wait_turn=None, reservation=None):
+    """
+    Deliver an album. Batches pass wait_turn, awaited only before sending, and
+    their ordered disk reservation.
+    """
     media_group_messages = await chat_message.get_media_group()
-    valid_media = []
-    temp_paths = []
-    invalid_paths = []
 
+    # Reserve disk space for the whole album before any item is written
+    group_size = sum(get_media_size(msg) for msg in media_group_messages)
+    with storage.workspace(f"{message.chat.id}_{message.id}_{chat_message.media_group_id}", group_size) as workspace:
+        async with (reservation or disk_budget.reservation)(f"{message.id}:group:{chat_message.media_group_id}", group_size):
+            return await _sendMediaGroup(media_group_messages, bot, message, workspace, wait_turn)
+
+
+ALBUM_INPUT_MEDIA = {
+    "photo": InputMediaPhoto,
+    "video": InputMediaVideo,
+    "document": InputMediaDocument,
+    "audio": InputMediaAudio,
+}
+
+
+def _album_media_type(msg) -> Optional[str]:
+    return next((media_type for media_type in ALBUM_INPUT_MEDIA if getattr(msg, media_type, None)), None)
+
+
+def _album_input_media(item):
+    media = item["file_id"] or item["path"]
+    if item["type"] == "video":
+        return InputMediaVideo(media=media, duration=item["duration"], caption=item["caption"])
+    return ALBUM_INPUT_MEDIA[item["type"]](media=media, caption=item["caption"])
+
+
+async def _sendMediaGroup(media_group_messages, bot, message, workspace, wait_turn=None):
+    """
+    Download the album items concurrently (at most ALBUM_CONCURRENCY at once),
+    reusing indexed file_ids, and send them as one group. If Telegram rejects the
+    group, the items are uploaded in parallel and then sent one by one in order.
+    """
     start_time = time()
-    progress_message = await message.reply("📥 Downloading media group...")
+    progress_message = await status_messages.claim(
+        message.from_user.id, message, "📥 Downloading media group..."
+    )
     LOGGER(__name__).info(
         f"Downloading media group with {len(media_group_messages)} items..."
     )
 
-    for msg in media_group_messages:
-        if msg.photo or msg.video or msg.document or msg.audio:
-            try:
+    slots = Semaphore(PyroConf.ALBUM_CONCURRENCY)
+    group_total = sum(get_media_size(msg) for msg in media_group_messages)
+    received: Dict[int, int] = {}
+
+    async def item_progress(current, total, index):
+        # Every item reports into one album-wide counter
+        received[index] = current
+        await progress_hub.update(
+            sum(received.values()), group_total, "📥 Downloading Progress", progress_message, start_time
+        )
+
+    async def download_item(index, item):
+        msg = item["msg"]
+        unique_id = getattr(get_media_object(msg), "file_unique_id", None)
+        async with slots:
+            download_path = os.path.join(workspace, get_file_name(msg.id, msg) or str(msg.id))
+            media_path = await media_cache.fetch(unique_id, download_path)
+            if not media_path:
                 media_path = await msg.download(
-                    progress=Leaves.progress_for_pyrogram,
-                    progress_args=progressArgs(
-                        "📥 Downloading Progress", progress_message, start_time
-                    ),
+                    file_name=download_path, progress=item_progress, progress_args=(index,)
                 )
-                temp_paths.append(media_path)
-
-                if msg.photo:
-                    valid_media.append(
-                        InputMediaPhoto(
-                            media=media_path,
-                            caption=await get_parsed_msg(
-                                msg.caption or "", msg.caption_entities
-                            ),
-                        )
-                    )
-                elif msg.video:
-                    duration = (await get_media_info(media_path))[0]
-                    valid_media.append(
-                        InputMediaVideo(
-                            media=media_path,
-                            duration=duration,
-                            caption=await get_parsed_msg(
-                                msg.caption or "", msg.caption_entities
-                            ),
-                        )
-                    )
-                elif msg.document:
-                    valid_media.append(
-                        InputMediaDocument(
-                            media=media_path,
-                            caption=await get_parsed_msg(
-                                msg.caption or "", msg.caption_entities
-                            ),
-                        )
-                    )
-                elif msg.audio:
-                    valid_media.append(
-                        InputMediaAudio(
-                            media=media_path,
-                            caption=await get_parsed_msg(
-                                msg.caption or "", msg.caption_entities
-                            ),
-                        )
-                    )
+                await media_cache.store(unique_id, media_path)
+        item["path"] = media_path
+        # Probe (only without a source duration) outside the slot so the next download starts meanwhile
+        if item["type"] == "video" and not item["duration"]:
+            item["duration"] = (await probe_media(media_path, unique_id))[0]
 
-            except Exception as e:
-                LOGGER(__name__).info(f"Error downloading media: {e}")
-                media_path = None
-                continue
+    async def fetch_item(index, msg):
+        media_type = _album_media_type(msg)
+        if not media_type:
+            return None
+        item = {
+            "msg": msg,
+            "type": media_type,
+            "caption": await get_parsed_msg(msg.caption or "", msg.caption_entities),
+            "file_id": indexed_file_id(msg, media_type),
+            "path": None,
+            "duration": getattr(msg.video, "duration", 0) if msg.video else 0,
+        }
+        try:
+            if not item["file_id"]:
+                await download_item(index, item)
+        except CancelledError:
+            raise
+        except Exception as e:
+            LOGGER(__name__).info(f"Error downloading media: {e}")
+            return None
+        return item
 
-    LOGGER(__name__).info(f"Valid media count: {len(valid_media)}")
+    items = [
+        item for item in await gather(*(fetch_item(index, msg) for index, msg in enumerate(media_group_messages)))
+        if item
+    ]
+    LOGGER(__name__).info(f"Valid media count: {len(items)}")
+
+    try:
+        if wait_turn:
+            await wait_turn()
+        if not items:
+            await progress_hub.close(progress_message)
+            await message.reply("❌ No valid media found in the media group.")
+            return False
 
-    if valid_media:
         try:
-            await bot.send_media_group(chat_id=message.chat.id, media=valid_media)
-            await progress_message.delete()
+            sent = await bot.send_media_group(
+                chat_id=message.chat.id, media=[_album_input_media(item) for item in items]
+            )
+            for item, sent_msg in zip(items, sent or []):
+                if not item["file_id"]:
+                    remember_delivery(item["msg"], sent_msg, item["type"])
+        except CancelledError:
+            raise
         except Exception:
             await message.reply(
                 "**❌ Failed to send media group, trying individual uploads**"
             )
-            for media in valid_media:
-                try:
-                    if isinstance(media, InputMediaPhoto):
-                        await bot.send_photo(
-                            chat_id=message.chat.id,
-                            photo=media.media,
-                            caption=media.caption,
-                        )
-                    elif isinstance(media, InputMediaVideo):
-                        await bot.send_video(
-                            chat_id=message.chat.id,
-                            video=media.media,
-                            duration=media.duration,
-                            caption=media.caption,
-                        )
-                    elif isinstance(media, InputMediaDocument):
-                        await bot.send_document(
-                            chat_id=message.chat.id,
-                            document=media.media,
-                            caption=media.caption,
-                        )
-                    elif isinstance(media, InputMediaAudio):
-                        await bot.send_audio(
-                            chat_id=message.chat.id,
-                            audio=media.media,
-                            caption=media.caption,
-                        )
-                    elif isinstance(media, Voice):
-                        await bot.send_voice(
-                            chat_id=message.chat.id,
-                            voice=media.media,
-                            caption=media.caption,
-                        )
-                except Exception as individual_e:
-                    await message.reply(
-                        f"Failed to upload individual media: {individual_e}"
-                    )
-
-            await progress_message.delete()
+            await _sendAlbumItems(items, bot, message, slots, download_item)
 
-        for path in temp_paths + invalid_paths:
-            cleanup_download(path)
+        await progress_hub.close(progress_message)
         return True
+    finally:
+        for item in items:
+            if item["path"]:
+                cleanup_download(item["path"])
 
-    await progress_message.delete()
-    await message.reply("❌ No valid media found in the media group.")
-    for path in invalid_paths:
-        cleanup_download(path)
-    return False
+
+async def _sendAlbumItems(items, bot, message, slots, download_item):
+    """Upload the album items in parallel, then send them one by one in album order"""
+    async def upload_item(item):
+        try:
+            if item["file_id"]:
+                return None
+            async with slots:
+                return await bot.save_file(item["path"])
+        except CancelledError:
+            raise
+        except Exception as e:
+            return e
+
+    uploads = await gather(*(upload_item(item) for item in items))
+
+    for index, (item, uploaded) in enumerate(zip(items, uploads)):
+        msg = item["msg"]
+        try:
+            if isinstance(uploaded, Exception):
+                raise uploaded
+            if item["file_id"]:
+                try:
+                    await bot.send_cached_media(message.chat.id, item["file_id"], caption=item["caption"])
+                    continue
+                except STALE_FILE_ERRORS as e:
+                    # The indexed file_id went stale, upload the file instead
+                    LOGGER(__name__).info(f"Indexed file_id rejected ({e}), uploading album item")
+                    forget_delivery(msg)
+                    item["file_id"] = None
+                    await download_item(index, item)
+                    uploaded = await bot.save_file(item["path"])
+
+            sent = await send_uploaded_media(
+                bot, message.chat.id, item["type"], uploaded, item["caption"],
+                duration=item["duration"],
+                width=getattr(msg.video, "width", 0) if msg.video else 0,
+                height=getattr(msg.video, "height", 0) if msg.video else 0,
+                performer=msg.audio.performer if msg.audio else None,
+                title=msg.audio.title if msg.audio else None,
+            )
+            if sent:
+                remember_delivery(msg, sent, item["type"])
+        except CancelledError:
+            raise
+        except Exception as individual_e:
+            await message.reply(
+                f"Failed to upload individual media: {individual_e}"
+            )
@@ -6,6 +6,7 @@ import shutil
 import psutil
 import asyncio
 from time import time
+from functools import partial
 from attribution import verify_attribution, get_channel_link, get_creator_username
 
 try:
@@ -16,38 +17,61 @@ try:
 except ImportError:
     pass
 
-from pyleaves import Leaves
 from pyrogram.enums import ParseMode
-from pyrogram import Client, filters
-from pyrogram.errors import PeerIdInvalid, BadRequest
+from pyrogram import Client, filters, idle
+from pyrogram.errors import PeerIdInvalid, BadRequest, FloodWait, FileReferenceExpired, FileReferenceInvalid
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 
 from helpers.utils import (
     processMediaGroup,
     progressArgs,
-    send_media
+    send_media,
+    thumbnail_cache,
+    media_tools,
+    media_priority,
+    MEDIA_PRIORITY_BATCH
 )
 
 from helpers.files import (
-    get_download_path,
     fileSizeLimit,
     get_readable_file_size,
     get_readable_time,
-    cleanup_download
+    cleanup_download,
+    disk_budget,
+    media_cache
+)
+
+from helpers.status import status_messages
+from helpers.batch import DeliveryOrder
+from helpers.storage import storage
+from helpers.progress import progress_hub
+from helpers.transfer import (
+    can_relay,
+    relay_media,
+    copy_to_user,
+    send_from_index,
+    remember_delivery,
+    is_protected,
+    can_download_chunked,
+    chunked_download,
+    media_sessions
 )
 
 from helpers.msg import (
     getChatMsgID,
     get_file_name,
-    get_parsed_msg
+    get_parsed_msg,
+    get_media_size,
+    get_media_object
 )
 
 from config import PyroConf
 from logger import LOGGER
 from database import db
+from metrics import metrics
 from phone_auth import PhoneAuthHandler
 from ad_monetization import ad_monetization, PREMIUM_DURATION_MINUTES
-from access_control import admin_only, paid_or_admin_only, check_download_limit, register_user, check_user_session, get_user_client, force_subscribe
+from access_control import admin_only, paid_or_admin_only, check_download_limit, register_user, check_user_session, get_user_client, release_user_client, close_user_client, force_subscribe
 from admin_commands import (
     add_admin_command,
     remove_admin_command,
@@ -61,9 +85,15 @@ from admin_commands import (
     broadcast_callback_handler
 )
 from queue_manager import download_queue
+from client_pool import user_client_pool, account_is_premium
+from rate_limiter import rate_limiter
+from peer_cache import PeerCachingClient, peer_cache
+
+# Attempts of the resumable downloader before falling back to a plain download
+DOWNLOAD_ATTEMPTS = 4
 
 # Initialize the bot client with optimized settings for faster downloads/uploads
-bot = Client(
+bot = PeerCachingClient(
     "media_bot",
     api_id=PyroConf.API_ID,
     api_hash=PyroConf.API_HASH,
@@ -74,7 +104,7 @@ bot = Client(
 )
 
 # Client for user session (optional fallback) with optimized settings
-user = Client(
+user = PeerCachingClient(
     "user_session", 
     workers=8,
     max_concurrent_transmissions=8,
@@ -268,7 +298,134 @@ async def help_command(_, message: Message):
     
     await message.reply(help_text, reply_markup=markup, disable_web_page_preview=True)
 
-async def handle_download(bot: Client, message: Message, post_url: str, user_client=None, increment_usage=True, cleanup_client=True):
+async def download_source(source_client, chat_message, download_path: str, post_url: str, progress_message, start_time):
+    """Download source media to download_path, resuming and retrying on errors"""
+    progress_args = progressArgs("📥 Downloading Progress", progress_message, start_time)
+    if can_download_chunked(chat_message):
+        for attempt in range(DOWNLOAD_ATTEMPTS):
+            try:
+                return await chunked_download(
+                    source_client,
+                    chat_message,
+                    download_path,
+                    progress=progress_hub.update,
+                    progress_args=progress_args,
+                )
+            except asyncio.CancelledError:
+                raise
+            except FloodWait as e:
+                LOGGER(__name__).warning(f"FloodWait of {e.value}s while downloading {post_url}")
+                await asyncio.sleep(e.value)
+            except (FileReferenceExpired, FileReferenceInvalid):
+                # File references go stale after a while, a fresh copy of the message renews them
+                chat_message = await source_client.get_messages(chat_message.chat.id, chat_message.id)
+            except Exception as e:
+                if attempt == DOWNLOAD_ATTEMPTS - 1:
+                    metrics.incr("chunked_download_fallback")
+                    LOGGER(__name__).warning(f"Chunked download failed for {post_url}, using single stream: {e}")
+                    break
+                delay = 2 ** attempt
+                LOGGER(__name__).warning(f"Download of {post_url} failed ({e}), resuming in {delay}s")
+                await asyncio.sleep(delay)
+
+    return await chat_message.download(
+        file_name=download_path,
+        progress=progress_hub.update,
+        progress_args=progress_args,
+    )
+
+async def transfer_media(source_client, bot: Client, message: Message, chat_message, post_url: str, media_type: str, caption: str, wait_turn=None, reservation=None):
+    """
+    Move a single media file from the source to the user through this server.
+    Batches pass a reservation that hands out disk space in post order.
+    """
+    # Media delivered before is resent by file_id; a video upload carries its uploader's
+    # thumbnail, so users with a custom thumbnail neither use nor feed the index
+    user_id = message.from_user.id
+    use_index = not (media_type == "video" and db.get_custom_thumbnail(user_id))
+    if use_index and await send_from_index(bot, chat_message, message, caption, wait_turn):
+        download_queue.mark_stage(user_id, "downloaded", media_type)
+        download_queue.mark_stage(user_id, "uploaded")
+        return
+
+    start_time = time()
+    # Reuse the queue status message for progress instead of sending another one
+    progress_message = await status_messages.claim(
+        user_id, message, "**📥 Downloading Progress...**"
+    )
+
+    # Stream straight from the source to the bot when nothing needs the file on disk
+    if PyroConf.STREAM_RELAY and can_relay(chat_message):
+        try:
+            sent = await relay_media(
+                source_client,
+                bot,
+                chat_message,
+                message,
+                caption,
+                progress=progress_hub.update,
+                progress_args=progressArgs("🔁 Relaying Progress", progress_message, start_time),
+                wait_turn=wait_turn,
+            )
+            metrics.incr("relay_transfers", outcome="relayed")
+            if sent and use_index:
+                remember_delivery(chat_message, sent, media_type)
+            download_queue.mark_stage(user_id, "downloaded", media_type)
+            download_queue.mark_stage(user_id, "uploaded")
+            await progress_hub.close(progress_message)
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            metrics.incr("relay_transfers", outcome="fallback")
+            LOGGER(__name__).warning(f"Relay failed for {post_url}, falling back to disk: {e}")
+
+    filename = get_file_name(chat_message.id, chat_message)
+
+    # Hold back until the file fits in the disk budget
+    media_size = get_media_size(chat_message)
+    if not disk_budget.fits(media_size):
+        await progress_message.edit("**⏳ Waiting for free disk space...**")
+    # One workspace per post: /bdl posts share the command message but not their files
+    with storage.workspace(f"{message.chat.id}_{message.id}_{chat_message.id}", media_size) as workspace:
+        download_path = os.path.join(workspace, filename)
+        async with (reservation or disk_budget.reservation)(f"{message.id}:{chat_message.id}", media_size):
+            unique_id = getattr(get_media_object(chat_message), "file_unique_id", None)
+            media_path = await media_cache.fetch(unique_id, download_path)
+            if not media_path:
+                media_path = await download_source(source_client, chat_message, download_path, post_url, progress_message, start_time)
+                LOGGER(__name__).info(f"Downloaded media: {media_path}")
+                if media_path:
+                    await media_cache.store(unique_id, media_path)
+
+            download_queue.mark_stage(user_id, "downloaded", media_type)
+            if wait_turn:
+                await wait_turn()
+            sent = await send_media(
+                bot,
+                message,
+                media_path,
+                media_type,
+                caption,
+                progress_message,
+                start_time,
+                user_id,
+                source_message=chat_message,
+            )
+            download_queue.mark_stage(user_id, "uploaded")
+            if sent and use_index:
+                remember_delivery(chat_message, sent, media_type)
+
+            cleanup_download(media_path)
+    await progress_hub.close(progress_message)
+
+async def handle_download(bot: Client, message: Message, post_url: str, user_client=None, increment_usage=True, cleanup_client=True, chat_message=None, wait_turn=None, reservation=None):
+    """
+    Deliver one post to the user. Batches pass the already fetched chat_message,
+    a wait_turn coroutine function that returns once it is this post's turn
+    to send, so posts can download concurrently but arrive in order, and the
+    batch's ordered disk reservation.
+    """
     # Cut off URL at '?' if present
     if "?" in post_url:
         post_url = post_url.split("?", 1)[0]
@@ -297,7 +454,8 @@ async def handle_download(bot: Client, message: Message, post_url: str, user_cli
                 )
                 return
 
-        chat_message = await client_to_use.get_messages(chat_id=chat_id, message_ids=message_id)
+        if chat_message is None:
+            chat_message = await client_to_use.get_messages(chat_id=chat_id, message_ids=message_id)
 
         LOGGER(__name__).info(f"Downloading media from URL: {post_url}")
 
@@ -310,22 +468,8 @@ async def handle_download(bot: Client, message: Message, post_url: str, user_cli
                 else chat_message.audio.file_size
             )
 
-            # Check file size limit based on actual client being used
-            try:
-                is_premium = False
-                if client_to_use != user:
-                    # User's personal client
-                    me = await client_to_use.get_me()
-                    is_premium = getattr(me, 'is_premium', False)
-                else:
-                    # Bot's session
-                    if hasattr(user, 'me') and user.me:
-                        is_premium = getattr(user.me, 'is_premium', False)
-                    else:
-                        me = await user.get_me()
-                        is_premium = getattr(me, 'is_premium', False)
-            except:
-                is_premium = False
+            # Check file size limit based on the account actually downloading
+            is_premium = account_is_premium(client_to_use)
 
             if not await fileSizeLimit(file_size, message, "download", is_premium):
                 return
@@ -338,29 +482,21 @@ async def handle_download(bot: Client, message: Message, post_url: str, user_cli
         )
 
         if chat_message.media_group_id:
-            if not await processMediaGroup(chat_message, bot, message):
+            download_queue.mark_stage(message.from_user.id, media_type="album")
+            if not is_protected(chat_message):
+                if wait_turn:
+                    await wait_turn()
+                if await copy_to_user(bot, chat_message, chat_id, message.chat.id):
+                    return
+            # Albums download like any other post and only wait for their turn to send
+            if not await processMediaGroup(chat_message, bot, message, wait_turn, reservation):
+                download_queue.mark_stage(message.from_user.id, "failed")
                 await message.reply(
                     "**Could not extract any valid media from the media group.**"
                 )
             return
 
         elif chat_message.media:
-            start_time = time()
-            progress_message = await message.reply("**📥 Downloading Progress...**")
-
-            filename = get_file_name(message_id, chat_message)
-            download_path = get_download_path(message.id, filename)
-
-            media_path = await chat_message.download(
-                file_name=download_path,
-                progress=Leaves.progress_for_pyrogram,
-                progress_args=progressArgs(
-                    "📥 Downloading Progress", progress_message, start_time
-                ),
-            )
-
-            LOGGER(__name__).info(f"Downloaded media: {media_path}")
-
             media_type = (
                 "photo"
                 if chat_message.photo
@@ -370,19 +506,22 @@ async def handle_download(bot: Client, message: Message, post_url: str, user_cli
                 if chat_message.audio
                 else "document"
             )
-            await send_media(
-                bot,
-                message,
-                media_path,
-                media_type,
-                parsed_caption,
-                progress_message,
-                start_time,
-                message.from_user.id,
-            )
 
-            cleanup_download(media_path)
-            await progress_message.delete()
+            # Unprotected posts the bot can read are copied server-side, no bytes pass through us
+            copied = False
+            if not is_protected(chat_message):
+                if wait_turn:
+                    await wait_turn()
+                copied = await copy_to_user(bot, chat_message, chat_id, message.chat.id)
+            if copied:
+                download_queue.mark_stage(message.from_user.id, "downloaded", media_type)
+                download_queue.mark_stage(message.from_user.id, "uploaded")
+            else:
+                await transfer_media(
+                    client_to_use, bot, message, chat_message, post_url, media_type, parsed_caption,
+                    wait_turn, reservation
+                )
+            download_queue.mark_stage(message.from_user.id, "cleaned")
 
             # Only increment usage after successful download
             if increment_usage:
@@ -408,51 +547,80 @@ async def handle_download(bot: Client, message: Message, post_url: str, user_cli
                     )
 
         elif chat_message.text or chat_message.caption:
+            download_queue.mark_stage(message.from_user.id, media_type="text")
+            if wait_turn:
+                await wait_turn()
             await message.reply(parsed_text or parsed_caption)
         else:
             await message.reply("**No media or text found in the post URL.**")
 
     except (PeerIdInvalid, BadRequest, KeyError):
+        download_queue.mark_stage(message.from_user.id, "failed")
         await message.reply("**Make sure the user client is part of the chat.**")
     except Exception as e:
+        download_queue.mark_stage(message.from_user.id, "failed")
         error_message = f"**❌ {str(e)}**"
         await message.reply(error_message)
         LOGGER(__name__).error(e)
     finally:
         # Clean up user client only if cleanup is enabled (not in batch mode)
         if cleanup_client and user_client and user_client != user:
-            try:
-                await user_client.stop()
-            except:
-                pass
-
-@bot.on_message(filters.command("dl") & filters.private)
-@force_subscribe
-@check_download_limit
-async def download_media(bot: Client, message: Message):
-    if len(message.command) < 2:
-        await message.reply("**Provide a post URL after the /dl command.**")
-        return
-
-    post_url = message.command[1]
+            await release_user_client(user_client)
 
-    # Check if user has personal session
-    user_client = await get_user_client(message.from_user.id)
-    
+async def enqueue_download(message: Message, post_url: str):
+    """Add a single-post download to the queue and tell the user where it landed"""
     # Check if user is premium for queue priority
-    is_premium = db.get_user_type(message.from_user.id) in ['premium', 'admin']
+    is_premium = db.get_user_type(message.from_user.id) in ['paid', 'admin']
     
-    # Add to download queue
-    download_coro = handle_download(bot, message, post_url, user_client, True)
     success, msg = await download_queue.add_to_queue(
         message.from_user.id,
-        download_coro,
         message,
         post_url,
         is_premium
     )
     
-    await message.reply(msg)
+    if msg:
+        await message.reply(msg)
+
+async def run_queued_download(message: Message, post_url: str):
+    """Run a queued download, holding the user's client only while the job is active"""
+    user_client = await get_user_client(message.from_user.id)
+    try:
+        await handle_download(bot, message, post_url, user_client, True, cleanup_client=False)
+    finally:
+        await release_user_client(user_client)
+
+async def load_queued_job(job: dict):
+    """Fetch the request message of a job stored in the shared queue"""
+    message = await bot.get_messages(job["chat_id"], job["message_id"])
+    if not message or message.empty:
+        raise ValueError("request message no longer exists")
+    return message
+
+async def notify_queued_job(job: dict, text: str):
+    """Tell the user about a stored job, in its status message when there is one"""
+    if job.get("status_message_id"):
+        try:
+            await bot.edit_message_text(job["chat_id"], job["status_message_id"], text)
+            return
+        except Exception as e:
+            LOGGER(__name__).debug(f"Could not edit status message of job {job['_id']}: {e}")
+    # The request message may be gone, so this is not sent as a reply to it
+    await bot.send_message(job["chat_id"], text)
+
+download_queue.set_job_runner(run_queued_download)
+download_queue.set_job_loader(load_queued_job)
+download_queue.set_job_notifier(notify_queued_job)
+
+@bot.on_message(filters.command("dl") & filters.private)
+@force_subscribe
+@check_download_limit
+async def download_media(bot: Client, message: Message):
+    if len(message.command) < 2:
+        await message.reply("**Provide a post URL after the /dl command.**")
+        return
+
+    await enqueue_download(message, message.command[1])
 
 @bot.on_message(filters.command("bdl") & filters.private)
 @force_subscribe
@@ -502,87 +670,120 @@ async def download_range(bot: Client, message: Message):
 
     # Check if user has personal session
     user_client = await get_user_client(message.from_user.id)
-    client_to_use = user_client
+    try:
+        client_to_use = user_client
     
-    if not client_to_use:
-        # Check if user is admin or owner
-        if db.is_admin(message.from_user.id) or message.from_user.id == PyroConf.OWNER_ID:
-            if user and not user.is_connected:
-                await user.start()
-            client_to_use = user
-        
         if not client_to_use:
-            await message.reply(
-                "❌ **No active session found.**\n\n"
-                "Please login with your phone number:\n"
-                "`/login +1234567890`"
-            )
-            return
+            # Check if user is admin or owner
+            if db.is_admin(message.from_user.id) or message.from_user.id == PyroConf.OWNER_ID:
+                if user and not user.is_connected:
+                    await user.start()
+                client_to_use = user
+        
+            if not client_to_use:
+                await message.reply(
+                    "❌ **No active session found.**\n\n"
+                    "Please login with your phone number:\n"
+                    "`/login +1234567890`"
+                )
+                return
 
-    try:
-        await client_to_use.get_chat(start_chat)
-    except Exception:
-        pass
+        # Warms the peer only when neither this client nor the peer cache knows it
+        try:
+            await client_to_use.resolve_peer(start_chat)
+        except Exception:
+            pass
 
-    prefix = args[1].rsplit("/", 1)[0]
-    loading = await message.reply(f"📥 **Downloading posts {start_id}–{end_id}…**")
+        prefix = args[1].rsplit("/", 1)[0]
+        loading = await message.reply(f"📥 **Downloading posts {start_id}–{end_id}…**")
 
-    downloaded = skipped = failed = 0
+        downloaded = skipped = failed = 0
+        cancelled = False
+        tasks = []
+        priority_token = None
 
-    for msg_id in range(start_id, end_id + 1):
-        url = f"{prefix}/{msg_id}"
         try:
-            chat_msg = await client_to_use.get_messages(chat_id=start_chat, message_ids=msg_id)
-            if not chat_msg:
-                skipped += 1
-                continue
-
-            has_media = bool(chat_msg.media_group_id or chat_msg.media)
-            has_text  = bool(chat_msg.text or chat_msg.caption)
-            if not (has_media or has_text):
-                skipped += 1
-                continue
-
-            task = track_task(handle_download(bot, message, url, client_to_use, False, cleanup_client=False), message.from_user.id)
-            try:
-                await task
-                downloaded += 1
-                # Increment usage count for batch downloads after success
-                db.increment_usage(message.from_user.id)
-            except asyncio.CancelledError:
-                await loading.delete()
-                # Clean up client before returning
-                if user_client and user_client != user:
-                    try:
-                        await user_client.stop()
-                    except:
-                        pass
-                return await message.reply(
-                    f"**❌ Batch canceled** after downloading `{downloaded}` posts."
-                )
-
-        except Exception as e:
-            failed += 1
-            LOGGER(__name__).error(f"Error at {url}: {e}")
+            # One request for the whole range instead of one per post
+            chat_messages = await client_to_use.get_messages(
+                chat_id=start_chat, message_ids=list(range(start_id, end_id + 1))
+            )
 
-        await asyncio.sleep(3)
+            posts = []
+            seen_groups = set()
+            for chat_msg in chat_messages:
+                if not chat_msg or chat_msg.empty:
+                    skipped += 1
+                    continue
+                if chat_msg.media_group_id:
+                    # Every album item is its own post ID, the album is sent once
+                    if chat_msg.media_group_id in seen_groups:
+                        continue
+                    seen_groups.add(chat_msg.media_group_id)
+                elif not (chat_msg.media or chat_msg.text or chat_msg.caption):
+                    skipped += 1
+                    continue
+                posts.append(chat_msg)
+
+            order = DeliveryOrder(len(posts))
+            slots = asyncio.Semaphore(PyroConf.BATCH_CONCURRENCY)
+
+            def post_finished(index: int, _task):
+                # Runs even for posts cancelled before they started
+                order.done(index)
+                slots.release()
+
+            # Posts of a batch give way to single downloads for ffmpeg/ffprobe
+            priority_token = media_priority.set(MEDIA_PRIORITY_BATCH)
+
+            # Slots are taken in post order, so a running post never waits on one that can't start
+            for index, chat_msg in enumerate(posts):
+                await slots.acquire()
+                task = track_task(
+                    handle_download(
+                        bot, message, f"{prefix}/{chat_msg.id}", client_to_use, False,
+                        cleanup_client=False, chat_message=chat_msg, wait_turn=partial(order.wait, index),
+                        reservation=partial(order.reservation, index)
+                    ),
+                    message.from_user.id
+                )
+                task.add_done_callback(partial(post_finished, index))
+                tasks.append(task)
+
+            for result in await asyncio.gather(*tasks, return_exceptions=True):
+                if isinstance(result, asyncio.CancelledError):
+                    cancelled = True
+                elif isinstance(result, Exception):
+                    failed += 1
+                    LOGGER(__name__).error(f"Error in batch {prefix}: {result}")
+                else:
+                    downloaded += 1
+                    # Increment usage count for batch downloads after success
+                    db.increment_usage(message.from_user.id)
+        except asyncio.CancelledError:
+            cancelled = True
+            for task in tasks:
+                task.cancel()
+        finally:
+            if priority_token:
+                media_priority.reset(priority_token)
+
+        await loading.delete()
+
+        if cancelled:
+            return await message.reply(
+                f"**❌ Batch canceled** after downloading `{downloaded}` posts."
+            )
 
-    await loading.delete()
-    
-    # Clean up user client after batch completes
-    if user_client and user_client != user:
-        try:
-            await user_client.stop()
-        except:
-            pass
-    
-    await message.reply(
-        "**✅ Batch Process Complete!**\n"
-        "━━━━━━━━━━━━━━━━━━━\n"
-        f"📥 **Downloaded** : `{downloaded}` post(s)\n"
-        f"⏭️ **Skipped**    : `{skipped}` (no content)\n"
-        f"❌ **Failed**     : `{failed}` error(s)"
-    )
+        await message.reply(
+            "**✅ Batch Process Complete!**\n"
+            "━━━━━━━━━━━━━━━━━━━\n"
+            f"📥 **Downloaded** : `{downloaded}` post(s)\n"
+            f"⏭️ **Skipped**    : `{skipped}` (no content)\n"
+            f"❌ **Failed**     : `{failed}` error(s)"
+        )
+    finally:
+        # Return user client to the pool after the batch, also when setting it up failed
+        await release_user_client(user_client)
 
 # Phone authentication commands
 @bot.on_message(filters.command("login") & filters.private)
@@ -682,6 +883,7 @@ async def logout_command(client: Client, message: Message):
     """Logout from account"""
     try:
         if db.set_user_session(message.from_user.id, None):
+            await close_user_client(message.from_user.id)
             await message.reply(
                 "✅ **Successfully logged out!**\n\n"
                 "Use `/login <phone_number>` to login again."
@@ -714,6 +916,9 @@ async def cancel_download_command(client: Client, message: Message):
 async def queue_status_command(client: Client, message: Message):
     """Check your download queue status"""
     status = await download_queue.get_queue_status(message.from_user.id)
+    transfers = progress_hub.summary(message.chat.id)
+    if transfers:
+        status += "\n\n**📶 Live Transfers:**\n" + "\n".join(f"• {line}" for line in transfers)
     await message.reply(status)
 
 @bot.on_message(filters.command("qstatus") & filters.private)
@@ -721,6 +926,15 @@ async def queue_status_command(client: Client, message: Message):
 async def global_queue_status_command(client: Client, message: Message):
     """Check global download queue status (admin only)"""
     status = await download_queue.get_global_status()
+    pool = user_client_pool.stats()
+    status += (
+        f"\n\n🔌 **User Clients:** {pool['connected']}/{pool['max_clients']} connected, "
+        f"{pool['busy']} busy"
+    )
+    limits = rate_limiter.stats()
+    status += f"\n🚦 **Rate Limiter:** {limits['buckets']} buckets, {limits['blocked']} in flood wait"
+    tools = media_tools.stats()
+    status += f"\n🎞 **Media Tools:** {tools['running']}/{tools['max_procs']} running, {tools['waiting']} waiting"
     await message.reply(status)
 
 @bot.on_message(filters.private & ~filters.command(["start", "help", "dl", "stats", "logs", "killall", "bdl", "myinfo", "upgrade", "premiumlist", "getpremium", "verifypremium", "login", "verify", "password", "logout", "cancel", "canceldownload", "queue", "qstatus", "setthumb", "delthumb", "viewthumb", "addadmin", "removeadmin", "setpremium", "removepremium", "ban", "unban", "broadcast", "adminstats", "userinfo"]))
@@ -728,23 +942,7 @@ async def global_queue_status_command(client: Client, message: Message):
 @check_download_limit
 async def handle_any_message(bot: Client, message: Message):
     if message.text and not message.text.startswith("/"):
-        # Check if user has personal session
-        user_client = await get_user_client(message.from_user.id)
-        
-        # Check if user is premium for queue priority
-        is_premium = db.get_user_type(message.from_user.id) in ['premium', 'admin']
-        
-        # Add to download queue
-        download_coro = handle_download(bot, message, message.text, user_client, True)
-        success, msg = await download_queue.add_to_queue(
-            message.from_user.id,
-            download_coro,
-            message,
-            message.text,
-            is_premium
-        )
-        
-        await message.reply(msg)
+        await enqueue_download(message, message.text)
 
 @bot.on_message(filters.command("stats") & filters.private)
 @register_user
@@ -760,6 +958,16 @@ async def stats(_, message: Message):
     memory = psutil.virtual_memory().percent
     disk = psutil.disk_usage("/").percent
     process = psutil.Process(os.getpid())
+    disk_status = disk_budget.status()
+    reserved = get_readable_file_size(disk_status["reserved"])
+    free_after = get_readable_file_size(disk_status["free_after_reservations"])
+    cache_text = ""
+    if media_cache.enabled:
+        cache_status = media_cache.status()
+        cache_text = (
+            f"**➜ Media Cache:** `{get_readable_file_size(cache_status['size'])}` / "
+            f"`{get_readable_file_size(cache_status['max_bytes'])}` ({cache_status['files']} files)\n"
+        )
 
     stats_text = (
         "**≧◉◡◉≦ Bot is Up and Running successfully.**\n\n"
@@ -767,6 +975,11 @@ async def stats(_, message: Message):
         f"**➜ Total Disk Space:** `{total}`\n"
         f"**➜ Used:** `{used}`\n"
         f"**➜ Free:** `{free}`\n"
+        f"**➜ Reserved for Downloads:** `{reserved}` ({disk_status['reservations']} job(s), {disk_status['waiting']} waiting)\n"
+        f"**➜ Free After Reservations:** `{free_after}`\n"
+        f"{cache_text}"
+        f"**➜ Job Files:** `{get_readable_file_size(storage.last_usage.get('bytes', 0))}` "
+        f"({storage.last_usage.get('files', 0)} files, {storage.last_usage.get('active_workspaces', 0)} active jobs)\n"
         f"**➜ Memory Usage:** `{round(process.memory_info()[0] / 1024**2)} MiB`\n\n"
         f"**➜ Upload:** `{sent}`\n"
         f"**➜ Download:** `{recv}`\n\n"
@@ -812,6 +1025,7 @@ async def set_thumbnail(_, message: Message):
         file_id = photo.file_id
         
         if db.set_custom_thumbnail(message.from_user.id, file_id):
+            thumbnail_cache.invalidate(message.from_user.id)
             await message.reply(
                 "✅ **Custom thumbnail saved successfully!**\n\n"
                 "This thumbnail will be used for all your video downloads.\n\n"
@@ -833,6 +1047,7 @@ async def set_thumbnail(_, message: Message):
 async def delete_thumbnail(_, message: Message):
     """Delete custom thumbnail"""
     if db.delete_custom_thumbnail(message.from_user.id):
+        thumbnail_cache.invalidate(message.from_user.id)
         await message.reply(
             "✅ **Custom thumbnail removed!**\n\n"
             "Videos will now use auto-generated thumbnails from the video itself."
@@ -1210,28 +1425,31 @@ async def callback_handler(client: Client, callback_query: CallbackQuery):
     else:
         await broadcast_callback_handler(client, callback_query)
 
-# Start queue processor in background when module loads
-def _init_queue():
-    """Initialize queue processor on module load"""
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(download_queue.start_processor())
-    LOGGER(__name__).info("Download queue processor initialized")
+async def run_bot():
+    """Start the bot and the queue processor on the same event loop"""
+    await bot.start()
+    storage.start_janitor()
+    await download_queue.start_processor()
+    LOGGER(__name__).info("Bot Started!")
+    try:
+        await idle()
+    finally:
+        await shutdown()
 
-# Schedule queue processor startup
-try:
-    import threading
-    threading.Thread(target=_init_queue, daemon=True).start()
-except:
-    LOGGER(__name__).warning("Could not start queue processor thread")
+async def shutdown():
+    """Stop the queue, pooled clients, media sessions and the bot; shared by main.py and server.py"""
+    await download_queue.stop_processor()
+    await user_client_pool.close_all()
+    await media_sessions.close_all()
+    await peer_cache.flush()
+    await bot.stop()
 
 # Verify bot attribution on startup
 verify_attribution()
 
 if __name__ == "__main__":
     try:
-        LOGGER(__name__).info("Bot Started!")
-        bot.run()
+        bot.run(run_bot())
     except KeyboardInterrupt:
         pass
     except Exception as err:
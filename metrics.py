@@ -0,0 +1,101 @@
+# Copyright (C) @Wolfy004
+# Channel: https://t.me/Wolfy004
+
+import threading
+from collections import deque, defaultdict
+from typing import Dict, Optional
+
+
+def _label_key(name: str, labels: Dict[str, str]) -> str:
+    if not labels:
+        return name
+    parts = ",".join(f"{k}={labels[k]}" for k in sorted(labels))
+    return f"{name}{{{parts}}}"
+
+
+class LatencyStats:
+    """Rolling window of duration samples with percentile summaries"""
+
+    def __init__(self, window: int = 1000):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value: float):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, pct: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+        return ordered[index]
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 3) if self.count else 0.0,
+            "p50": round(self.percentile(50), 3),
+            "p95": round(self.percentile(95), 3),
+            "p99": round(self.percentile(99), 3),
+            "max": round(self.max, 3),
+        }
+
+
+class Metrics:
+    """Process-wide counters and latency histograms.
+
+    Written from the bot event loop and read from the Flask thread, so every
+    access goes through a plain threading lock.
+    """
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = defaultdict(int)
+        self._latencies: Dict[str, Dict[str, LatencyStats]] = defaultdict(dict)
+
+    def incr(self, name: str, value: int = 1, **labels):
+        key = _label_key(name, labels)
+        with self._lock:
+            self._counters[key] += value
+
+    def observe(self, name: str, seconds: Optional[float], **labels):
+        if seconds is None or seconds < 0:
+            return
+        key = _label_key(name, labels)
+        with self._lock:
+            stats = self._latencies[name].get(key)
+            if stats is None:
+                stats = self._latencies[name][key] = LatencyStats(self.window)
+            stats.add(seconds)
+
+    def get_counter(self, name: str, **labels) -> int:
+        with self._lock:
+            return self._counters.get(_label_key(name, labels), 0)
+
+    def counters(self, prefix: str = "") -> Dict[str, int]:
+        with self._lock:
+            return {k: v for k, v in self._counters.items() if k.startswith(prefix)}
+
+    def latency_summary(self, name: str) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {key: stats.summary() for key, stats in self._latencies.get(name, {}).items()}
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "latencies": {
+                    name: {key: stats.summary() for key, stats in series.items()}
+                    for name, series in self._latencies.items()
+                },
+            }
+
+
+metrics = Metrics()
@@ -0,0 +1,143 @@
+# Copyright (C) @Wolfy004
+# Channel: https://t.me/Wolfy004
+
+import asyncio
+from time import time
+from datetime import datetime, timedelta
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from pyrogram import raw, utils
+
+from database import db
+from logger import LOGGER
+from metrics import metrics
+from rate_limiter import RateLimitedClient
+
+# Pyrogram stops trusting a username after 8 hours; older ones are seeded without it
+USERNAME_MAX_AGE = 8 * 3600
+# Unchanged peers are written again at most this often, keeping them clear of the 30 day TTL
+REWRITE_INTERVAL = 86400
+
+
+def peer_row(peer, include_users: bool = True) -> Optional[Dict]:
+    """Cacheable row for a raw User/Channel: channels, and users reachable by username"""
+    if getattr(peer, "min", False) or not getattr(peer, "access_hash", None):
+        return None
+    usernames = getattr(peer, "usernames", None)
+    username = getattr(peer, "username", None) or (usernames[0].username if usernames else None)
+    username = username.lower() if username else None
+
+    if isinstance(peer, raw.types.Channel):
+        peer_id = utils.get_channel_id(peer.id)
+        peer_type = "channel" if peer.broadcast else "supergroup"
+    elif isinstance(peer, raw.types.User) and include_users and username:
+        peer_id = peer.id
+        peer_type = "bot" if peer.bot else "user"
+    else:
+        return None
+    return {"peer_id": peer_id, "access_hash": peer.access_hash, "type": peer_type, "username": username}
+
+
+class PeerCache:
+    """
+    Process-wide cache of the peers each account has resolved.
+
+    Clients run with in-memory sessions, so every new or reconnected client
+    starts with an empty peer table and would resolve the same channels and
+    usernames again. Peers seen in API responses are collected per account,
+    written to MongoDB in batches and loaded into a client's storage on start.
+    """
+
+    def __init__(self, max_peers: int = 5000, flush_interval: int = 30):
+        self.max_peers = max_peers
+        self.flush_interval = flush_interval
+        self._pending: Dict[int, Dict[int, Dict]] = {}
+        self._known: Dict[int, "OrderedDict[int, Tuple[Tuple, float]]"] = {}
+        self._flusher: Optional[asyncio.Task] = None
+
+    def _known_for(self, account_id: int) -> "OrderedDict[int, Tuple[Tuple, float]]":
+        known = self._known.get(account_id)
+        if known is None:
+            known = self._known[account_id] = OrderedDict()
+        return known
+
+    def record(self, account_id: int, peers, include_users: bool = True):
+        """Queue new or changed peers from an API response for saving"""
+        known = self._known_for(account_id)
+        now = time()
+        for peer in peers:
+            row = peer_row(peer, include_users)
+            if not row:
+                continue
+            state = (row["access_hash"], row["username"])
+            previous = known.get(row["peer_id"])
+            if previous and previous[0] == state and now - previous[1] < REWRITE_INTERVAL:
+                continue
+            known[row["peer_id"]] = (state, now)
+            known.move_to_end(row["peer_id"])
+            row["last_seen"] = datetime.now()
+            self._pending.setdefault(account_id, {})[row["peer_id"]] = row
+
+        while len(known) > self.max_peers:
+            known.popitem(last=False)
+        if self._pending:
+            self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._run_flusher())
+
+    async def _run_flusher(self):
+        while self._pending:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        for account_id, rows in pending.items():
+            if await asyncio.to_thread(db.save_peers, account_id, list(rows.values())):
+                metrics.incr("peer_cache", len(rows), result="saved")
+
+    async def seed(self, client) -> int:
+        """Load the account's cached peers into a freshly started client"""
+        account_id = client.me.id if client.me else await client.storage.user_id()
+        if not account_id:
+            return 0
+        rows = await asyncio.to_thread(db.get_peers, account_id, self.max_peers)
+        fresh_after = datetime.now() - timedelta(seconds=USERNAME_MAX_AGE)
+
+        peers = []
+        known = self._known_for(account_id)
+        for row in reversed(rows):
+            username = row.get("username") if row.get("last_seen", fresh_after) >= fresh_after else None
+            peers.append((row["peer_id"], row["access_hash"], row["type"], username, None))
+            known.setdefault(row["peer_id"], ((row["access_hash"], row.get("username")), time()))
+
+        if peers:
+            await client.storage.update_peers(peers)
+            metrics.incr("peer_cache", len(peers), result="seeded")
+            LOGGER(__name__).info(f"Seeded {len(peers)} cached peers into {client.name}")
+        return len(peers)
+
+
+class PeerCachingClient(RateLimitedClient):
+    """Rate limited client that shares the peers it resolves through the peer cache"""
+
+    async def start(self, *args, **kwargs):
+        result = await super().start(*args, **kwargs)
+        try:
+            await peer_cache.seed(self)
+        except Exception as e:
+            LOGGER(__name__).warning(f"Could not seed cached peers into {self.name}: {e}")
+        return result
+
+    async def fetch_peers(self, peers) -> bool:
+        is_min = await super().fetch_peers(peers)
+        if self.me:
+            # Bots see every user who talks to them; only channels are worth sharing there
+            peer_cache.record(self.me.id, peers, include_users=not self.bot_token)
+        return is_min
+
+
+peer_cache = PeerCache()
@@ -1,39 +1,101 @@
+import os
+import socket
 import asyncio
 from datetime import datetime
-from typing import Dict, Set, Optional, Tuple
+from time import time
+from typing import Dict, Set, Optional, Tuple, Callable, Awaitable, Any
 from dataclasses import dataclass, field
 from enum import IntEnum
 from logger import LOGGER
+from metrics import metrics
+from config import PyroConf
+from database import db
+from helpers.status import status_messages
+from helpers.storage import storage
 
 class Priority(IntEnum):
     PREMIUM = 1
     FREE = 2
 
+TIERS = ("premium", "free")
+JOB_STAGES = ("enqueued", "dispatched", "downloaded", "uploaded", "cleaned", "finished")
+
+@dataclass
+class JobTimeline:
+    """Per-job timestamps used to build queue wait and service time metrics"""
+    user_id: int
+    tier: str
+    media_type: str = "unknown"
+    failed: bool = False
+    stamps: Dict[str, float] = field(default_factory=dict)
+
+    def mark(self, stage: str, at: Optional[float] = None):
+        self.stamps.setdefault(stage, at or time())
+
+    def between(self, start: str, end: str) -> Optional[float]:
+        if start in self.stamps and end in self.stamps:
+            return self.stamps[end] - self.stamps[start]
+        return None
+
 @dataclass(order=True)
 class QueueItem:
     priority: int
     timestamp: float = field(compare=True)
     user_id: int = field(compare=False)
-    download_coro: any = field(compare=False)
     message: any = field(compare=False)
     post_url: str = field(compare=False)
+    timeline: Optional[JobTimeline] = field(default=None, compare=False)
 
 class DownloadQueueManager:
-    def __init__(self, max_concurrent: int = 20, max_queue: int = 100):
+    def __init__(
+        self,
+        max_concurrent: int = 20,
+        max_queue: int = 100,
+        backend: str = "local",
+        lease_seconds: int = 60,
+        instance_id: Optional[str] = None
+    ):
         self.max_concurrent = max_concurrent
         self.max_queue = max_queue
         
+        # In "mongo" mode the waiting queue lives in the download_jobs collection and
+        # every bot instance claims jobs from it with a heartbeat-renewed lease
+        self.shared = backend == "mongo"
+        self.lease_seconds = lease_seconds
+        self.instance_id = instance_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.job_runner: Optional[Callable[[Any, str], Awaitable[None]]] = None
+        self.job_loader: Optional[Callable[[Dict], Awaitable[Any]]] = None
+        self.job_notifier: Optional[Callable[[Dict, str], Awaitable[None]]] = None
+        self.active_jobs: Dict[int, Dict] = {}
+        self._last_heartbeat = 0.0
+        
         self.active_downloads: Set[int] = set()
         self.waiting_queue: list[QueueItem] = []
         
         self.user_queue_positions: Dict[int, QueueItem] = {}
         self.active_tasks: Dict[int, asyncio.Task] = {}
+        self.active_timelines: Dict[int, JobTimeline] = {}
         
         self._lock = asyncio.Lock()
         self._processing = False
         self._processor_task: Optional[asyncio.Task] = None
         
-        LOGGER(__name__).info(f"Queue Manager initialized: {max_concurrent} concurrent, {max_queue} max queue")
+        LOGGER(__name__).info(
+            f"Queue Manager initialized: {max_concurrent} concurrent, {max_queue} max queue, "
+            f"backend={'mongo (' + self.instance_id + ')' if self.shared else 'local'}"
+        )
+    
+    def set_job_runner(self, runner: Callable[[Any, str], Awaitable[None]]):
+        """Register the coroutine function run as runner(message, post_url) when a job starts"""
+        self.job_runner = runner
+    
+    def set_job_loader(self, loader: Callable[[Dict], Awaitable[Any]]):
+        """Register the coroutine that turns a stored job back into its request message"""
+        self.job_loader = loader
+    
+    def set_job_notifier(self, notifier: Callable[[Dict, str], Awaitable[None]]):
+        """Register the coroutine run as notifier(job, text) to tell a user their stored job failed"""
+        self.job_notifier = notifier
     
     async def start_processor(self):
         if not self._processing:
@@ -54,13 +116,20 @@ class DownloadQueueManager:
     async def add_to_queue(
         self, 
         user_id: int, 
-        download_coro, 
         message,
         post_url: str,
         is_premium: bool = False
     ) -> Tuple[bool, str]:
+        tier = "premium" if is_premium else "free"
+        timeline = JobTimeline(user_id=user_id, tier=tier)
+        timeline.mark("enqueued")
+
+        if self.shared:
+            return self._add_shared_job(user_id, message, post_url, is_premium, timeline)
+
         async with self._lock:
             if user_id in self.user_queue_positions or user_id in self.active_downloads:
+                metrics.incr("queue_rejected", reason="duplicate", tier=tier)
                 position = self.get_queue_position(user_id)
                 if user_id in self.active_downloads:
                     return False, "❌ **You already have a download in progress!**\n\nPlease wait for it to complete."
@@ -69,6 +138,7 @@ class DownloadQueueManager:
             
             if len(self.active_downloads) >= self.max_concurrent:
                 if len(self.waiting_queue) >= self.max_queue:
+                    metrics.incr("queue_rejected", reason="queue_full", tier=tier)
                     return False, (
                         f"❌ **Download queue is full!**\n\n"
                         f"🔄 **Active Downloads:** {len(self.active_downloads)}/{self.max_concurrent}\n"
@@ -81,9 +151,9 @@ class DownloadQueueManager:
                     priority=priority,
                     timestamp=datetime.now().timestamp(),
                     user_id=user_id,
-                    download_coro=download_coro,
                     message=message,
-                    post_url=post_url
+                    post_url=post_url,
+                    timeline=timeline
                 )
                 
                 self.waiting_queue.append(queue_item)
@@ -93,42 +163,125 @@ class DownloadQueueManager:
                 position = self.get_queue_position(user_id)
                 premium_badge = "👑 **PREMIUM**" if is_premium else "🆓 **FREE**"
                 
-                return True, (
+                # This message is edited in place when the download starts
+                asyncio.create_task(status_messages.update(user_id, message, (
                     f"⏳ **Download added to queue!**\n\n"
                     f"{premium_badge}\n"
                     f"📍 **Your Position:** #{position}/{len(self.waiting_queue)}\n"
                     f"🔄 **Active Downloads:** {len(self.active_downloads)}/{self.max_concurrent}\n\n"
-                    f"💡 You'll be notified when your download starts!"
-                )
+                    f"💡 This message will update when your download starts!"
+                )))
+                return True, None
             else:
                 self.active_downloads.add(user_id)
-                task = asyncio.create_task(self._execute_download(user_id, download_coro, message))
-                self.active_tasks[user_id] = task
+                timeline.mark("dispatched")
+                self.active_timelines[user_id] = timeline
                 
+                # Created before the download task so it is published before the download claims it
                 status_msg = f"✅ **Download started!**\n\n🔄 **Active Downloads:** {len(self.active_downloads)}/{self.max_concurrent}"
-                asyncio.create_task(self._send_auto_delete_message(message, status_msg, 10))
+                asyncio.create_task(status_messages.update(user_id, message, status_msg))
+                
+                task = asyncio.create_task(self._execute_download(user_id, message, post_url))
+                self.active_tasks[user_id] = task
                 
                 return True, None
     
-    async def _send_auto_delete_message(self, message, text: str, delete_after: int):
-        """Send a message and auto-delete it after specified seconds"""
-        try:
-            sent_msg = await message.reply(text)
-            await asyncio.sleep(delete_after)
-            await sent_msg.delete()
-        except Exception as e:
-            LOGGER(__name__).debug(f"Failed to auto-delete message: {e}")
+    def _add_shared_job(self, user_id: int, message, post_url: str, is_premium: bool, timeline: JobTimeline) -> Tuple[bool, str]:
+        tier = timeline.tier
+        active, waiting, _ = self._queue_counts()
+        if waiting >= self.max_queue:
+            metrics.incr("queue_rejected", reason="queue_full", tier=tier)
+            return False, (
+                f"❌ **Download queue is full!**\n\n"
+                f"🔄 **Active Downloads:** {active}\n"
+                f"⏳ **Waiting in Queue:** {waiting}/{self.max_queue}\n\n"
+                f"Please try again later."
+            )
+
+        job = {
+            "user_id": user_id,
+            "chat_id": message.chat.id,
+            "message_id": message.id,
+            "post_url": post_url,
+            "priority": int(Priority.PREMIUM if is_premium else Priority.FREE),
+            "enqueued_at": timeline.stamps["enqueued"]
+        }
+        if not db.enqueue_job(job):
+            metrics.incr("queue_rejected", reason="duplicate", tier=tier)
+            existing = db.get_user_job(user_id)
+            if existing and existing.get("status") == "active":
+                return False, "❌ **You already have a download in progress!**\n\nPlease wait for it to complete."
+            position = db.get_job_position(existing) if existing else 0
+            return False, f"❌ **You already have a download in the queue!**\n\n📍 **Position:** #{position}/{waiting}"
+
+        position = db.get_job_position(job)
+        premium_badge = "👑 **PREMIUM**" if is_premium else "🆓 **FREE**"
+        asyncio.create_task(self._publish_shared_status(user_id, message, (
+            f"⏳ **Download added to queue!**\n\n"
+            f"{premium_badge}\n"
+            f"📍 **Your Position:** #{position}/{waiting + 1}\n"
+            f"🔄 **Active Downloads:** {active}\n\n"
+            f"💡 This message will update when your download starts!"
+        )))
+        return True, None
+
+    async def _publish_shared_status(self, user_id: int, message, text: str):
+        """Send the queued status and record it on the job so any instance can edit it"""
+        sent = await status_messages.update(user_id, message, text)
+        if sent:
+            db.set_job_status_message(user_id, sent.id)
     
-    async def _execute_download(self, user_id: int, download_coro, message):
+    def mark_stage(self, user_id: int, stage: Optional[str] = None, media_type: Optional[str] = None):
+        """Record a pipeline stage for the user's active job (no-op outside the queue)"""
+        timeline = self.active_timelines.get(user_id)
+        if not timeline:
+            return
+        if media_type:
+            timeline.media_type = media_type
+        if stage == "failed":
+            timeline.failed = True
+        elif stage in JOB_STAGES:
+            timeline.mark(stage)
+
+    def _record_job(self, timeline: JobTimeline, outcome: str):
+        timeline.mark("finished")
+        labels = {"tier": timeline.tier, "media": timeline.media_type}
+
+        metrics.incr("jobs_total", outcome=outcome, tier=timeline.tier)
+        metrics.observe("queue_wait", timeline.between("enqueued", "dispatched"), tier=timeline.tier)
+        metrics.observe("download_time", timeline.between("dispatched", "downloaded"), **labels)
+        metrics.observe("upload_time", timeline.between("downloaded", "uploaded"), **labels)
+        metrics.observe("cleanup_time", timeline.between("uploaded", "cleaned"), **labels)
+        if outcome == "completed":
+            metrics.observe("service_time", timeline.between("dispatched", "finished"), **labels)
+
+    async def _execute_download(self, user_id: int, message, post_url: str):
+        # Jobs only carry the request; the runner acquires the user's client now
+        # and releases it when done, so waiting jobs hold no connections
+        outcome = "completed"
         try:
-            await download_coro
+            await self.job_runner(message, post_url)
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
         except Exception as e:
+            outcome = "failed"
             LOGGER(__name__).error(f"Download error for user {user_id}: {e}")
             try:
                 await message.reply(f"❌ **Download failed:** {str(e)}")
             except:
                 pass
         finally:
+            timeline = self.active_timelines.pop(user_id, None)
+            if timeline:
+                if outcome == "completed" and timeline.failed:
+                    outcome = "failed"
+                self._record_job(timeline, outcome)
+            job = self.active_jobs.pop(user_id, None)
+            if job:
+                status = "done" if outcome == "completed" else outcome
+                db.finish_job(job["_id"], status, owner=self.instance_id)
+            status_messages.finish(user_id)
             async with self._lock:
                 self.active_downloads.discard(user_id)
                 self.active_tasks.pop(user_id, None)
@@ -139,6 +292,10 @@ class DownloadQueueManager:
             try:
                 await asyncio.sleep(1)
                 
+                if self.shared:
+                    await self._process_shared_queue()
+                    continue
+                
                 async with self._lock:
                     while len(self.active_downloads) < self.max_concurrent and self.waiting_queue:
                         queue_item = self.waiting_queue.pop(0)
@@ -150,15 +307,15 @@ class DownloadQueueManager:
                             continue
                         
                         self.active_downloads.add(user_id)
+                        if queue_item.timeline:
+                            queue_item.timeline.mark("dispatched")
+                            self.active_timelines[user_id] = queue_item.timeline
                         
-                        try:
-                            status_msg = f"🚀 **Your download is starting now!**\n\n📥 Downloading: `{queue_item.post_url}`"
-                            asyncio.create_task(self._send_auto_delete_message(queue_item.message, status_msg, 10))
-                        except:
-                            pass
+                        status_msg = f"🚀 **Your download is starting now!**\n\n📥 Downloading: `{queue_item.post_url}`"
+                        asyncio.create_task(status_messages.update(user_id, queue_item.message, status_msg))
                         
                         task = asyncio.create_task(
-                            self._execute_download(user_id, queue_item.download_coro, queue_item.message)
+                            self._execute_download(user_id, queue_item.message, queue_item.post_url)
                         )
                         self.active_tasks[user_id] = task
                         
@@ -172,6 +329,88 @@ class DownloadQueueManager:
             except Exception as e:
                 LOGGER(__name__).error(f"Queue processor error: {e}")
     
+    async def _process_shared_queue(self):
+        now = time()
+        if now - self._last_heartbeat >= self.lease_seconds / 3:
+            self._last_heartbeat = now
+            self._renew_leases()
+            requeued = db.requeue_expired_jobs()
+            if requeued:
+                LOGGER(__name__).warning(f"Re-queued {requeued} job(s) with expired leases")
+
+        while self._processing and len(self.active_downloads) < self.max_concurrent:
+            job = db.claim_job(self.instance_id, self.lease_seconds)
+            if not job:
+                break
+            await self._start_shared_job(job)
+
+    def _renew_leases(self):
+        for user_id, job in list(self.active_jobs.items()):
+            if db.renew_job_lease(job["_id"], self.instance_id, self.lease_seconds):
+                continue
+            # Cancelled from another instance, or our lease expired and the job was re-queued
+            LOGGER(__name__).warning(f"Lost lease on job {job['_id']} for user {user_id}, stopping local download")
+            self.active_jobs.pop(user_id, None)
+            task = self.active_tasks.get(user_id)
+            if task and not task.done():
+                task.cancel()
+
+    async def _start_shared_job(self, job: Dict):
+        user_id = job["user_id"]
+        tier = "premium" if job.get("priority") == Priority.PREMIUM else "free"
+        timeline = JobTimeline(user_id=user_id, tier=tier)
+        timeline.mark("enqueued", job.get("enqueued_at"))
+        timeline.mark("dispatched")
+
+        if user_id in self.active_downloads or not self.job_loader or not self.job_runner:
+            await self._fail_shared_job(job, timeline, "this instance cannot run it")
+            return
+
+        try:
+            message = await self.job_loader(job)
+            if job.get("status_message_id"):
+                status_messages.adopt(user_id, message._client, job["chat_id"], job["status_message_id"])
+            status_msg = f"🚀 **Your download is starting now!**\n\n📥 Downloading: `{job['post_url']}`"
+            asyncio.create_task(status_messages.update(user_id, message, status_msg))
+
+            async with self._lock:
+                self.active_downloads.add(user_id)
+                self.active_jobs[user_id] = job
+                self.active_timelines[user_id] = timeline
+                task = asyncio.create_task(self._execute_download(user_id, message, job["post_url"]))
+                self.active_tasks[user_id] = task
+        except Exception as e:
+            await self._fail_shared_job(job, timeline, e)
+            return
+        LOGGER(__name__).info(
+            f"Claimed job {job['_id']} for user {user_id}. Active on {self.instance_id}: {len(self.active_downloads)}"
+        )
+
+    async def _fail_shared_job(self, job: Dict, timeline: JobTimeline, reason):
+        """Give up a claimed job that could not start: release its lease and tell the user"""
+        user_id = job["user_id"]
+        LOGGER(__name__).error(f"Could not start job {job['_id']} for user {user_id}: {reason}")
+        if not db.finish_job(job["_id"], "failed", owner=self.instance_id):
+            LOGGER(__name__).warning(f"Job {job['_id']} stays held until its lease expires")
+        self._record_job(timeline, "failed")
+        if user_id not in self.active_downloads:
+            # The status message carries the failure notice, so it must not be deleted
+            status_messages.forget(user_id)
+        if not self.job_notifier:
+            return
+        try:
+            await self.job_notifier(job, f"❌ **Download failed to start:** {reason}")
+        except Exception as e:
+            LOGGER(__name__).warning(f"Could not notify user {user_id} about job {job['_id']}: {e}")
+
+    def _queue_counts(self) -> Tuple[int, int, int]:
+        """(active, waiting, waiting_premium) for this instance, or cluster-wide in shared mode"""
+        if self.shared:
+            counts = db.get_job_counts()
+            return counts["active"], counts["queued"], counts["queued_premium"]
+        premium = sum(1 for item in self.waiting_queue if item.priority == Priority.PREMIUM)
+        return len(self.active_downloads), len(self.waiting_queue), premium
+
     def get_queue_position(self, user_id: int) -> int:
         for idx, item in enumerate(self.waiting_queue, 1):
             if item.user_id == user_id:
@@ -179,6 +418,9 @@ class DownloadQueueManager:
         return 0
     
     async def get_queue_status(self, user_id: int) -> str:
+        if self.shared:
+            return self._get_shared_queue_status(user_id)
+
         async with self._lock:
             if user_id in self.active_downloads:
                 return (
@@ -207,22 +449,106 @@ class DownloadQueueManager:
                 f"💡 Send a download link to get started!"
             )
     
+    def _get_shared_queue_status(self, user_id: int) -> str:
+        active, waiting, _ = self._queue_counts()
+        job = db.get_user_job(user_id)
+        if job and job.get("status") == "active":
+            return (
+                f"📥 **Your download is currently active!**\n\n"
+                f"🔄 **Active Downloads:** {active}\n"
+                f"⏳ **Waiting in Queue:** {waiting}/{self.max_queue}"
+            )
+        if job:
+            position = db.get_job_position(job)
+            priority_text = "👑 **PREMIUM**" if job.get("priority") == Priority.PREMIUM else "🆓 **FREE**"
+            return (
+                f"⏳ **You're in the queue!**\n\n"
+                f"{priority_text}\n"
+                f"📍 **Your Position:** #{position}/{waiting}\n"
+                f"🔄 **Active Downloads:** {active}\n\n"
+                f"💡 Estimated wait: ~{position * 2} minutes"
+            )
+        return (
+            f"✅ **No active downloads**\n\n"
+            f"🔄 **Active Downloads:** {active}\n"
+            f"⏳ **Waiting in Queue:** {waiting}/{self.max_queue}\n\n"
+            f"💡 Send a download link to get started!"
+        )
+
     async def get_global_status(self) -> str:
         async with self._lock:
-            premium_in_queue = sum(1 for item in self.waiting_queue if item.priority == Priority.PREMIUM)
-            free_in_queue = len(self.waiting_queue) - premium_in_queue
+            active, waiting, premium_in_queue = self._queue_counts()
+            free_in_queue = waiting - premium_in_queue
             
-            return (
+            if self.shared:
+                active_text = (
+                    f"🔄 **Active Downloads:** {active} (all instances)\n"
+                    f"🖥️ **This Instance:** `{self.instance_id}` {len(self.active_downloads)}/{self.max_concurrent}\n"
+                )
+            else:
+                active_text = f"🔄 **Active Downloads:** {active}/{self.max_concurrent}\n"
+            
+            status = (
                 f"📊 **Queue System Status**\n"
                 f"━━━━━━━━━━━━━━━━━━━\n"
-                f"🔄 **Active Downloads:** {len(self.active_downloads)}/{self.max_concurrent}\n"
-                f"⏳ **Waiting in Queue:** {len(self.waiting_queue)}/{self.max_queue}\n\n"
+                f"{active_text}"
+                f"⏳ **Waiting in Queue:** {waiting}/{self.max_queue}\n\n"
                 f"👑 Premium in queue: {premium_in_queue}\n"
                 f"🆓 Free in queue: {free_in_queue}\n\n"
-                f"💡 Premium users get priority!"
             )
+
+        status += self._format_metrics()
+        return status + "\n💡 Premium users get priority!"
+
+    def _format_metrics(self) -> str:
+        def total(name: str, **labels) -> int:
+            return sum(metrics.get_counter(name, tier=tier, **labels) for tier in TIERS)
+
+        text = (
+            f"📈 **Jobs:** ✅ {total('jobs_total', outcome='completed')} | "
+            f"❌ {total('jobs_total', outcome='failed')} | "
+            f"🚫 {total('jobs_total', outcome='cancelled')} | "
+            f"🈵 {total('queue_rejected', reason='queue_full')} rejected (queue full)\n"
+        )
+
+        hits = metrics.get_counter("media_index", result="hit")
+        lookups = hits + metrics.get_counter("media_index", result="miss")
+        if lookups:
+            text += (
+                f"♻️ **Media index:** {hits}/{lookups} hits ({hits / lookups * 100:.0f}%), "
+                f"{metrics.get_counter('media_index', result='invalid')} invalidated\n"
+            )
+
+        for name, title in (("queue_wait", "Queue wait"), ("service_time", "Service time")):
+            for key, summary in sorted(metrics.latency_summary(name).items()):
+                label = key[len(name):].strip("{}") or "all"
+                text += (
+                    f"⏱️ {title} [{label}]: p50 `{summary['p50']:.1f}s` "
+                    f"p95 `{summary['p95']:.1f}s` p99 `{summary['p99']:.1f}s` (n={summary['count']})\n"
+                )
+        return text
+
+    def get_metrics(self) -> Dict:
+        """Machine-readable queue state and job metrics"""
+        snapshot = metrics.snapshot()
+        active, waiting, waiting_premium = self._queue_counts()
+        snapshot["queue"] = {
+            "backend": "mongo" if self.shared else "local",
+            "instance": self.instance_id,
+            "active": active,
+            "active_local": len(self.active_downloads),
+            "max_concurrent": self.max_concurrent,
+            "waiting": waiting,
+            "max_queue": self.max_queue,
+            "waiting_premium": waiting_premium,
+        }
+        snapshot["storage"] = storage.last_usage
+        return snapshot
     
     async def cancel_user_download(self, user_id: int) -> Tuple[bool, str]:
+        if self.shared:
+            return await self._cancel_shared_download(user_id)
+
         async with self._lock:
             if user_id in self.active_downloads:
                 task = self.active_tasks.get(user_id)
@@ -236,13 +562,45 @@ class DownloadQueueManager:
             if queue_item and queue_item in self.waiting_queue:
                 self.waiting_queue.remove(queue_item)
                 self.user_queue_positions.pop(user_id, None)
+                status_messages.finish(user_id, delete_after=0)
+                if queue_item.timeline:
+                    self._record_job(queue_item.timeline, "cancelled")
                 return True, "✅ **Removed from download queue!**"
             
             return False, "❌ **No active download or queue entry found.**"
     
+    async def _cancel_shared_download(self, user_id: int) -> Tuple[bool, str]:
+        job = db.cancel_user_job(user_id)
+        async with self._lock:
+            task = self.active_tasks.get(user_id)
+            if task and not task.done():
+                task.cancel()
+                return True, "✅ **Active download cancelled!**"
+
+        if not job:
+            return False, "❌ **No active download or queue entry found.**"
+        if job.get("status") == "active":
+            # The owning instance notices the lost lease on its next heartbeat
+            return True, "✅ **Active download cancelled!**"
+
+        status_messages.finish(user_id, delete_after=0)
+        tier = "premium" if job.get("priority") == Priority.PREMIUM else "free"
+        timeline = JobTimeline(user_id=user_id, tier=tier)
+        timeline.mark("enqueued", job.get("enqueued_at"))
+        self._record_job(timeline, "cancelled")
+        return True, "✅ **Removed from download queue!**"
+
     async def cancel_all_downloads(self) -> int:
         async with self._lock:
             cancelled = 0
+
+            if self.shared:
+                for task in self.active_tasks.values():
+                    if not task.done():
+                        task.cancel()
+                cancelled = db.cancel_all_jobs()
+                LOGGER(__name__).info(f"Cancelled all shared downloads: {cancelled} total")
+                return cancelled
             
             for task in self.active_tasks.values():
                 if not task.done():
@@ -253,10 +611,20 @@ class DownloadQueueManager:
             self.active_tasks.clear()
             
             cancelled += len(self.waiting_queue)
+            for queue_item in self.waiting_queue:
+                status_messages.finish(queue_item.user_id, delete_after=0)
+                if queue_item.timeline:
+                    self._record_job(queue_item.timeline, "cancelled")
             self.waiting_queue.clear()
             self.user_queue_positions.clear()
             
             LOGGER(__name__).info(f"Cancelled all downloads: {cancelled} total")
             return cancelled
 
-download_queue = DownloadQueueManager(max_concurrent=20, max_queue=100)
+download_queue = DownloadQueueManager(
+    max_concurrent=20,
+    max_queue=100,
+    backend=PyroConf.QUEUE_BACKEND,
+    lease_seconds=PyroConf.QUEUE_LEASE_SECONDS,
+    instance_id=PyroConf.INSTANCE_ID or None
+)
@@ -0,0 +1,209 @@
+# Copyright (C) @Wolfy004
+# Channel: https://t.me/Wolfy004
+
+import asyncio
+from time import monotonic
+from typing import Dict, Optional, Tuple
+
+from pyrogram import Client
+from pyrogram.errors import FloodWait
+from pyrogram.session import Session
+
+from config import PyroConf
+from logger import LOGGER
+from metrics import metrics
+
+# Raw method name prefixes mapped to the class they are paced by
+METHOD_CLASSES = (
+    ("SendMessage", "send"),
+    ("SendMedia", "send"),
+    ("SendMultiMedia", "send"),
+    ("ForwardMessages", "send"),
+    ("EditMessage", "edit"),
+    ("DeleteMessages", "delete"),
+    ("SaveFilePart", "upload"),
+    ("SaveBigFilePart", "upload"),
+    ("GetFile", "download"),
+    ("ResolveUsername", "resolve"),
+    ("SetBotCallbackAnswer", "callback"),
+)
+
+# (rate per second, burst) per client kind and method class; missing classes are not paced
+CLASS_LIMITS = {
+    "bot": {"all": (30, 30), "send": (25, 25), "edit": (20, 20), "delete": (10, 10)},
+    "user": {"all": (20, 20), "send": (5, 5), "edit": (5, 5), "resolve": (0.5, 3)},
+}
+
+# Per chat limits for sends and edits: private chats ~1/s, groups and channels ~20/min
+CHAT_LIMITS = {
+    "private": (1, 3),
+    "group": (20 / 60, 5),
+}
+
+# Transfers are bandwidth bound and use their own sessions, they skip the client bucket
+UNPACED_CLASSES = {"upload", "download"}
+PER_CHAT_CLASSES = {"send", "edit"}
+# Bucket created for an unpaced method class once it floods; only its penalty matters
+PENALTY_LIMIT = (1000, 1000)
+
+
+class TokenBucket:
+    """Classic token bucket; acquire() waits until a token is free or a flood penalty has passed"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> float:
+        waited = 0.0
+        while True:
+            now = monotonic()
+            if now < self.blocked_until:
+                delay = self.blocked_until - now
+            else:
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            await asyncio.sleep(delay)
+            waited += delay
+
+    def penalize(self, seconds: float):
+        """Hold every caller of this bucket back while Telegram's flood wait runs"""
+        self.blocked_until = max(self.blocked_until, monotonic() + seconds)
+        self.tokens = 0
+
+    def idle(self, now: float) -> bool:
+        return now >= self.blocked_until and self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class RateLimiter:
+    """
+    Process-wide pacing of outbound Telegram calls.
+
+    Every call takes a token from its client's bucket, its method class bucket
+    and, for sends and edits, the target chat's bucket. A FloodWait blocks the
+    bucket it belongs to for the requested time so other callers queue behind
+    it instead of running into the same limit.
+    """
+
+    def __init__(self, max_buckets: int = 10000):
+        self.max_buckets = max_buckets
+        self._buckets: Dict[Tuple, TokenBucket] = {}
+
+    def _bucket(self, key: Tuple, limit: Tuple[float, float]) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_buckets:
+                self._prune()
+            bucket = self._buckets[key] = TokenBucket(*limit)
+        return bucket
+
+    def _prune(self):
+        now = monotonic()
+        for key in [key for key, bucket in self._buckets.items() if bucket.idle(now)]:
+            del self._buckets[key]
+
+    def buckets_for(self, client_name: str, kind: str, method_class: str, peer: Optional[Tuple[str, int]]):
+        limits = CLASS_LIMITS.get(kind, {})
+        buckets = []
+        if method_class not in UNPACED_CLASSES and "all" in limits:
+            buckets.append(self._bucket((client_name, "all"), limits["all"]))
+        if method_class in limits or (client_name, method_class) in self._buckets:
+            buckets.append(self._bucket((client_name, method_class), limits.get(method_class, PENALTY_LIMIT)))
+        if peer and method_class in PER_CHAT_CLASSES:
+            chat_limit = CHAT_LIMITS["private" if peer[0] == "user" else "group"]
+            buckets.append(self._bucket((client_name, "chat", peer), chat_limit))
+        return buckets
+
+    async def acquire(self, client_name: str, kind: str, method_class: str, peer: Optional[Tuple[str, int]]) -> float:
+        waited = 0.0
+        for bucket in self.buckets_for(client_name, kind, method_class, peer):
+            waited += await bucket.acquire()
+        if waited:
+            metrics.observe("rate_limit_wait", waited, client=kind, method=method_class)
+        return waited
+
+    def penalize(self, client_name: str, kind: str, method_class: str, peer: Optional[Tuple[str, int]], seconds: float):
+        """Block only what flooded: the chat for sends and edits, otherwise the method class"""
+        if method_class in UNPACED_CLASSES:
+            return  # transfers run on their own sessions and wait out their floods themselves
+        if peer and method_class in PER_CHAT_CLASSES:
+            key, limit = (client_name, "chat", peer), CHAT_LIMITS["private" if peer[0] == "user" else "group"]
+        else:
+            # Classes without a limit get a bucket on demand, so a flood on e.g. callback
+            # answers holds back those calls but never the client's shared "all" bucket
+            limit = CLASS_LIMITS.get(kind, {}).get(method_class) or PENALTY_LIMIT
+            key = (client_name, method_class)
+        self._bucket(key, limit).penalize(seconds)
+
+    def stats(self) -> Dict[str, int]:
+        now = monotonic()
+        return {
+            "buckets": len(self._buckets),
+            "blocked": sum(1 for bucket in self._buckets.values() if bucket.blocked_until > now),
+        }
+
+
+def method_class(query) -> str:
+    name = type(query).__name__
+    for prefix, cls in METHOD_CLASSES:
+        if name.startswith(prefix):
+            return cls
+    return "other"
+
+
+def target_peer(query) -> Optional[Tuple[str, int]]:
+    peer = getattr(query, "peer", None)
+    for attr, kind in (("user_id", "user"), ("chat_id", "chat"), ("channel_id", "channel")):
+        value = getattr(peer, attr, None)
+        if value is not None:
+            return kind, value
+    return None
+
+
+class RateLimitedClient(Client):
+    """
+    Client whose API calls are paced by the shared rate limiter.
+
+    FloodWaits up to FLOOD_WAIT_MAX seconds are waited out and the call retried,
+    so jobs slow down instead of failing; longer ones are raised to the caller.
+    """
+
+    async def invoke(
+        self,
+        query,
+        retries: int = Session.MAX_RETRIES,
+        timeout: float = Session.WAIT_TIMEOUT,
+        sleep_threshold: float = None
+    ):
+        cls = method_class(query)
+        peer = target_peer(query)
+        kind = "bot" if self.bot_token else "user"
+
+        attempt = 0
+        while True:
+            await rate_limiter.acquire(self.name, kind, cls, peer)
+            try:
+                # Flood waits are handled here instead of inside the session so every one is recorded
+                return await super().invoke(query, retries, timeout, 0 if sleep_threshold is None else sleep_threshold)
+            except FloodWait as e:
+                attempt += 1
+                metrics.incr("flood_wait", client=kind, method=cls)
+                metrics.observe("flood_wait_seconds", e.value, client=kind, method=cls)
+                rate_limiter.penalize(self.name, kind, cls, peer, e.value)
+                if e.value > PyroConf.FLOOD_WAIT_MAX or attempt > PyroConf.FLOOD_WAIT_RETRIES:
+                    LOGGER(__name__).warning(f"{type(query).__name__} on {self.name} flooded for {e.value}s, giving up")
+                    raise
+                LOGGER(__name__).info(f"{type(query).__name__} on {self.name} flooded for {e.value}s, retrying")
+
+
+rate_limiter = RateLimiter()
@@ -4,6 +4,7 @@ This satisfies Render's port binding requirement while keeping the bot running
 """
 import os
 import sys
+import hmac
 from flask import Flask, jsonify, render_template, request
 from ad_monetization import ad_monetization
 
@@ -21,6 +22,21 @@ def index():
 def health():
     return jsonify({'status': 'healthy'}), 200
 
+@app.route('/api/queue-metrics')
+def queue_metrics():
+    """Machine-readable queue gauges, job counters and latency percentiles"""
+    from config import PyroConf
+    from queue_manager import download_queue
+
+    # Disabled unless a token is configured: the metrics describe tiers and user activity
+    if not PyroConf.METRICS_TOKEN:
+        return jsonify({'error': 'not found'}), 404
+    token = request.headers.get('X-Metrics-Token', '') or request.args.get('token', '')
+    if not hmac.compare_digest(token.encode(), PyroConf.METRICS_TOKEN.encode()):
+        return jsonify({'error': 'unauthorized'}), 401
+
+    return jsonify(download_queue.get_metrics())
+
 @app.route('/watch-ad')
 def watch_ad():
     session_id = request.args.get('session', '')
@@ -83,11 +99,15 @@ def run_bot():
         try:
             main.LOGGER(__name__).info("Starting Telegram bot from server.py (long polling)")
             await main.bot.start()
+            main.storage.start_janitor()
+            # The queue processor must run on the bot's loop (it dispatches and, in
+            # shared mode, claims jobs from MongoDB)
+            await main.download_queue.start_processor()
             main.LOGGER(__name__).info("Bot started successfully, waiting for updates...")
             # Keep the bot running without signal handlers (thread-safe alternative to idle())
             await asyncio.Event().wait()
         finally:
-            await main.bot.stop()
+            await main.shutdown()
             main.LOGGER(__name__).info("Bot stopped")
     
     # Run the async coroutine on this thread's event loop
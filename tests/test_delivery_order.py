@@ -0,0 +1,59 @@
+# Copyright (C) @Wolfy004
+# Channel: https://t.me/Wolfy004
+
+import asyncio
+
+from helpers.batch import DeliveryOrder
+from helpers.files import DiskBudget
+
+
+def run_batch(arrival_times, size, budget_bytes):
+    """Run a batch the way download_range does; returns the order posts were sent in"""
+    budget = DiskBudget(budget_bytes=budget_bytes, high_water_percent=100)
+    budget._disk_usage = lambda: (10 ** 12, 0, 10 ** 12)
+    sent = []
+
+    async def post(order, index, arrival_time):
+        try:
+            # Time spent before the download starts, e.g. an index lookup or a failed relay
+            await asyncio.sleep(arrival_time)
+            async with order.reservation(index, f"post:{index}", size):
+                await asyncio.sleep(0.01)
+                await order.wait(index)
+                sent.append(index)
+        finally:
+            order.done(index)
+
+    async def batch():
+        order = DeliveryOrder(len(arrival_times), budget)
+        await asyncio.wait_for(
+            asyncio.gather(*(post(order, index, t) for index, t in enumerate(arrival_times))),
+            timeout=5,
+        )
+        assert not budget._reservations
+
+    asyncio.run(batch())
+    return sent
+
+
+def test_later_posts_finishing_first_do_not_starve_earlier_ones():
+    # Room for one post at a time, and later posts are ready to download first
+    assert run_batch([0.03, 0.02, 0.01], size=60, budget_bytes=100) == [0, 1, 2]
+
+
+def test_posts_share_the_budget_when_it_fits():
+    assert run_batch([0.03, 0.02, 0.01], size=30, budget_bytes=100) == [0, 1, 2]
+
+
+def test_failed_post_does_not_block_the_rest():
+    budget = DiskBudget(budget_bytes=100, high_water_percent=100)
+    budget._disk_usage = lambda: (10 ** 12, 0, 10 ** 12)
+
+    async def batch():
+        order = DeliveryOrder(2, budget)
+        # Post 0 fails before it reaches its reservation
+        order.done(0)
+        async with order.reservation(1, "post:1", 60):
+            await asyncio.wait_for(order.wait(1), timeout=1)
+
+    asyncio.run(batch())